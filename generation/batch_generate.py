@@ -0,0 +1,211 @@
+"""
+Regenerate every CloudRig metarig in a list of .blend files, without any UI.
+
+Each file is regenerated by its own background Blender process, and those
+processes are run from a bounded worker pool, so many files can be processed
+in parallel. Requires Rigify and the CloudRig feature set to be enabled in
+the user preferences that Blender starts with.
+
+Usage:
+	blender -b -P batch_generate.py -- [--jobs N] [--report report.json] [--no-save] [--force] file1.blend file2.blend ...
+	python batch_generate.py --blender /path/to/blender [--jobs N] [--report report.json] file1.blend ...
+
+Each worker process is started like so, and only regenerates the file it opened:
+	blender -b file.blend -P batch_generate.py -- --worker --report file_report.json
+"""
+
+import sys, os, json, argparse, subprocess, tempfile, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+	import bpy
+except ImportError:
+	# Running as a plain Python script, which can only dispatch worker processes.
+	bpy = None
+
+def get_script_args():
+	"""Return the arguments meant for this script, rather than for Blender."""
+	if "--" in sys.argv:
+		return sys.argv[sys.argv.index("--")+1:]
+	if bpy:
+		return []
+	return sys.argv[1:]
+
+def parse_args(args):
+	parser = argparse.ArgumentParser(description="Regenerate all CloudRig metarigs in a list of .blend files.")
+	parser.add_argument('files', nargs='*', help=".blend files to regenerate")
+	parser.add_argument('--blender', default=bpy.app.binary_path if bpy else "blender", help="Blender executable used by the worker processes")
+	parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Maximum number of Blender processes to run at once")
+	parser.add_argument('--report', default="", help="Path of the JSON report to write. Printed to stdout if not provided")
+	parser.add_argument('--no-save', action='store_true', help="Don't save the regenerated files")
+	parser.add_argument('--force', action='store_true', help="Regenerate metarigs even if nothing changed since their last generation")
+	parser.add_argument('--worker', action='store_true', help="Regenerate the currently opened file. Used internally")
+	return parser.parse_args(args)
+
+#######################################
+########## Worker (in Blender) ########
+
+def find_cloudrig_module(module_name):
+	"""Find an already imported module of the CloudRig feature set, since
+	its location depends on where the feature set was installed."""
+	for name, module in list(sys.modules.items()):
+		if name.startswith("rigify.feature_sets.") and name.endswith(module_name):
+			return module
+	raise ImportError(f"CloudRig module {module_name} not found. Make sure Rigify and the CloudRig feature set are enabled.")
+
+def log_entries_to_dicts(metarig):
+	"""Convert the Generation Log entries of a metarig to plain dictionaries."""
+	entries = []
+	for entry in metarig.data.cloudrig_parameters.logs:
+		entries.append({
+			prop.identifier : getattr(entry, prop.identifier)
+			for prop in entry.bl_rna.properties
+			if prop.identifier != 'rna_type' and prop.type in {'STRING', 'INT', 'FLOAT', 'BOOLEAN', 'ENUM'}
+			and not getattr(prop, 'is_array', False) and not getattr(prop, 'is_enum_flag', False)
+		})
+	return entries
+
+def regenerate_metarig(context, metarig, force=True) -> dict:
+	"""Regenerate a single metarig through CloudGenerator and return a report."""
+	cloud_generator = find_cloudrig_module(".generation.cloud_generator")
+	object_module = find_cloudrig_module(".rig_features.object")
+
+	report = {
+		'metarig' : metarig.name
+		,'success' : False
+		,'skipped' : False
+	}
+
+	# Only hash the metarig's bones once, for both the up-to-date check and the generator.
+	bones_hash = find_cloudrig_module(".generation.fingerprint").hash_metarig_bones(metarig)
+	if not force and cloud_generator.is_generation_up_to_date(metarig, bones_hash):
+		rig = metarig.data.rigify_target_rig
+		report.update({'success' : True, 'skipped' : True, 'rig' : rig.name, 'duration' : 0.0, 'logs' : []})
+		return report
+
+	meta_visible = object_module.EnsureVisible(metarig)
+	target_rig = metarig.data.rigify_target_rig
+	rig_visible = object_module.EnsureVisible(target_rig) if target_rig else None
+	context.view_layer.objects.active = metarig
+
+	start = time.perf_counter()
+	generator = cloud_generator.CloudGenerator(context, metarig, bones_hash)
+	try:
+		generator.generate(context)
+		report['success'] = True
+	except Exception as exc:
+		report['error'] = str(exc)
+		report['traceback'] = traceback.format_exc()
+		if hasattr(generator, 'obj'):
+			generator.restore_rig_states()
+	report['duration'] = time.perf_counter() - start
+
+	if hasattr(generator, 'metrics') and report['success']:
+		report['metrics'] = generator.metrics.as_dict(generator)
+	report['logs'] = log_entries_to_dicts(metarig)
+
+	meta_visible.restore()
+	if rig_visible:
+		rig_visible.restore()
+
+	rig = metarig.data.rigify_target_rig
+	report['rig'] = rig.name if rig else ""
+	return report
+
+def regenerate_file(context, save=True, force=False) -> dict:
+	"""Regenerate every CloudRig metarig in the currently opened file."""
+	cloud_generator = find_cloudrig_module(".generation.cloud_generator")
+
+	if context.object and context.object.mode != 'OBJECT':
+		bpy.ops.object.mode_set(mode='OBJECT')
+
+	metarigs = [o for o in context.scene.objects if cloud_generator.is_cloud_metarig(o)]
+
+	file_report = {
+		'file' : bpy.data.filepath
+		,'rigs' : [regenerate_metarig(context, metarig, force) for metarig in metarigs]
+		,'saved' : False
+	}
+	file_report['success'] = all([rig_report['success'] for rig_report in file_report['rigs']])
+	regenerated = [rig_report for rig_report in file_report['rigs'] if not rig_report['skipped']]
+
+	if save and regenerated and file_report['success']:
+		bpy.ops.wm.save_mainfile()
+		file_report['saved'] = True
+
+	return file_report
+
+#######################################
+########## Dispatcher #################
+
+def run_worker(blender, filepath, save=True, force=False) -> dict:
+	"""Regenerate a .blend file in a separate background Blender process."""
+	fd, report_path = tempfile.mkstemp(suffix=".json")
+	os.close(fd)
+	cmd = [blender, "-b", filepath, "-P", os.path.realpath(__file__), "--", "--worker", "--report", report_path]
+	if not save:
+		cmd.append("--no-save")
+	if force:
+		cmd.append("--force")
+
+	start = time.perf_counter()
+	process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	try:
+		with open(report_path) as f:
+			file_report = json.load(f)
+	except (OSError, ValueError):
+		file_report = {
+			'file' : filepath
+			,'rigs' : []
+			,'saved' : False
+			,'success' : False
+			,'error' : f"Blender exited with code {process.returncode} without writing a report."
+			,'output' : process.stdout[-5000:]
+		}
+	finally:
+		os.remove(report_path)
+
+	file_report['process_duration'] = time.perf_counter() - start
+	return file_report
+
+def dispatch(args) -> list:
+	"""Regenerate each file in its own Blender process, with at most args.jobs processes at a time."""
+	files = [os.path.abspath(f) for f in args.files]
+	with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+		futures = [pool.submit(run_worker, args.blender, f, not args.no_save, args.force) for f in files]
+		reports = []
+		for future in futures:
+			file_report = future.result()
+			status = "OK" if file_report['success'] else "FAILED"
+			print(f"{status}: {file_report['file']} ({file_report['process_duration']:.1f}s)")
+			reports.append(file_report)
+	return reports
+
+def write_report(report, filepath):
+	text = json.dumps(report, indent=4)
+	if filepath:
+		with open(filepath, 'w') as f:
+			f.write(text)
+	else:
+		print(text)
+
+def main():
+	args = parse_args(get_script_args())
+
+	if args.worker:
+		file_report = regenerate_file(bpy.context, save=not args.no_save, force=args.force)
+		write_report(file_report, args.report)
+		return file_report['success']
+
+	if not args.files:
+		print("No .blend files given, nothing to do.")
+		return True
+
+	reports = dispatch(args)
+	write_report(reports, args.report)
+	return all([file_report['success'] for file_report in reports])
+
+if __name__ == "__main__":
+	success = main()
+	if not success:
+		sys.exit(1)
@@ -0,0 +1,204 @@
+"""
+Benchmark CloudGenerator on synthetic metarigs of increasing size.
+
+The metarigs are built from FK chains, face chains, nested chain hierarchies
+and symmetrical .L/.R pairs, so the results only depend on the generator and
+not on any particular character file. Each generation stage is timed, and the
+results can be compared against a stored baseline to catch regressions.
+Requires Rigify and the CloudRig feature set to be enabled in the user preferences.
+
+Usage:
+	blender -b -P benchmark_generator.py -- [--sizes 100 1000 5000] [--repeat 3] [--output results.json]
+		[--baseline baseline.json] [--threshold 1.25] [--stage-threshold "Write Edit Data=1.5"] [--update-baseline]
+
+Comparing two existing result files doesn't require Blender:
+	python benchmark_generator.py --compare results.json --baseline baseline.json
+"""
+
+import sys, os, json, argparse, statistics
+
+try:
+	import bpy
+	from mathutils import Vector
+except ImportError:
+	bpy = None
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from batch_generate import get_script_args, regenerate_metarig
+
+# Rig types used for each chain layout. Nested chains are FK chains parented to the previous nested chain.
+LAYOUTS = {
+	'FK' : 'cloud_fk_chain'
+	,'FACE' : 'cloud_face_chain'
+	,'NESTED' : 'cloud_fk_chain'
+}
+
+def parse_args(args):
+	parser = argparse.ArgumentParser(description="Benchmark CloudRig generation on synthetic metarigs.")
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000], help="Number of metarig bones of each benchmarked metarig")
+	parser.add_argument('--chain-length', type=int, default=4, help="Number of bones in each chain")
+	parser.add_argument('--repeat', type=int, default=3, help="Number of generations per size. The median of each stage is kept")
+	parser.add_argument('--output', default="", help="Path of the JSON results file. Printed to stdout if not provided")
+	parser.add_argument('--compare', default="", help="Compare an existing results file against the baseline, without running any benchmarks")
+	parser.add_argument('--baseline', default="", help="Path of a results file to compare against")
+	parser.add_argument('--update-baseline', action='store_true', help="Overwrite the baseline with the new results")
+	parser.add_argument('--threshold', type=float, default=1.25, help="A stage regressed if it became slower than the baseline by this factor")
+	parser.add_argument('--stage-threshold', action='append', default=[], help='Override the threshold of a single stage, eg. "Write Edit Data=1.5"')
+	parser.add_argument('--min-duration', type=float, default=0.05, help="Ignore slowdowns smaller than this many seconds, as they are mostly noise")
+	return parser.parse_args(args)
+
+#######################################
+######## Synthetic metarigs ###########
+
+def new_chain(edit_bones, name, head, direction, length, parent=None, connect=False):
+	"""Create a chain of connected bones, returning the list of their names."""
+	names = []
+	for i in range(length):
+		eb = edit_bones.new(name.replace("#", str(i+1)))
+		eb.head = head
+		eb.tail = head + direction
+		eb.parent = parent
+		eb.use_connect = connect and parent is not None
+		names.append(eb.name)
+		parent, head, connect = eb, eb.tail.copy(), True
+	return names
+
+def build_synthetic_metarig(context, bone_count: int, chain_length=4):
+	"""Create a metarig with roughly bone_count bones. Chain layouts are used
+	in turn, and FK and face chains are created as symmetrical .L/.R pairs."""
+	data = bpy.data.armatures.new(f"Data_META-Benchmark_{bone_count}")
+	metarig = bpy.data.objects.new(f"META-Benchmark_{bone_count}", data)
+	context.scene.collection.objects.link(metarig)
+	context.view_layer.objects.active = metarig
+	bpy.ops.object.mode_set(mode='EDIT')
+
+	edit_bones = data.edit_bones
+	rig_types = {}
+	step = 0.1
+	nested_parent = None
+	i = 0
+	while len(edit_bones) + chain_length <= bone_count:
+		layout = list(LAYOUTS.keys())[i % len(LAYOUTS)]
+		row = i // len(LAYOUTS)
+		if layout == 'NESTED':
+			head = nested_parent.tail.copy() if nested_parent else Vector((0, 0, 0))
+			names = new_chain(edit_bones, f"Nested{row:04d}_#", head, Vector((0, 0, step)), chain_length, parent=nested_parent)
+			nested_parent = edit_bones[names[-1]]
+			rig_types[names[0]] = LAYOUTS[layout]
+		else:
+			for side, sign in (("L", 1), ("R", -1)):
+				if len(edit_bones) + chain_length > bone_count:
+					break
+				head = Vector((sign * (0.2 + row * step), 1 if layout == 'FACE' else 0, row * step))
+				names = new_chain(edit_bones, f"{layout.title()}{row:04d}_#.{side}", head, Vector((sign * step, 0, 0)), chain_length)
+				rig_types[names[0]] = LAYOUTS[layout]
+		i += 1
+
+	bpy.ops.object.mode_set(mode='OBJECT')
+
+	for bone_name, rig_type in rig_types.items():
+		metarig.pose.bones[bone_name].rigify_type = rig_type
+
+	return metarig
+
+#######################################
+############ Benchmarking #############
+
+def benchmark_size(context, bone_count: int, chain_length=4, repeat=3) -> dict:
+	"""Generate a synthetic metarig several times, and keep the median duration of each stage."""
+	runs = []
+	for _ in range(repeat):
+		# Start each run from an empty file, so earlier runs don't affect the timings.
+		bpy.ops.wm.read_homefile(use_empty=True)
+		context = bpy.context
+		metarig = build_synthetic_metarig(context, bone_count, chain_length)
+		report = regenerate_metarig(context, metarig)
+		if not report['success']:
+			raise RuntimeError(f"Generation of {bone_count} bone metarig failed:\n{report.get('traceback', '')}")
+		runs.append(report['metrics'])
+
+	stage_names = runs[0]['stages'].keys()
+	return {
+		'metarig_bones' : len(metarig.data.bones)
+		,'rig_bones' : runs[0]['bone_count']
+		,'rig_components' : runs[0]['rig_count']
+		,'total' : statistics.median([run['total'] for run in runs])
+		,'stages' : {stage : statistics.median([run['stages'].get(stage, 0.0) for run in runs]) for stage in stage_names}
+	}
+
+def run_benchmarks(args) -> dict:
+	results = {
+		'blender' : bpy.app.version_string
+		,'chain_length' : args.chain_length
+		,'repeat' : args.repeat
+		,'sizes' : {}
+	}
+	for bone_count in args.sizes:
+		print(f"Benchmarking generation of a {bone_count} bone metarig...")
+		results['sizes'][str(bone_count)] = benchmark_size(bpy.context, bone_count, args.chain_length, args.repeat)
+	return results
+
+def parse_stage_thresholds(stage_thresholds) -> dict:
+	thresholds = {}
+	for entry in stage_thresholds:
+		stage, value = entry.rsplit("=", 1)
+		thresholds[stage.strip()] = float(value)
+	return thresholds
+
+def find_regressions(results, baseline, threshold=1.25, stage_thresholds={}, min_duration=0.05) -> list:
+	"""Return a list of (size, stage, baseline duration, new duration) for every
+	stage that became slower than its threshold allows."""
+	regressions = []
+	for size, base in baseline['sizes'].items():
+		new = results['sizes'].get(size)
+		if not new:
+			continue
+		pairs = [('Total', base['total'], new['total'])]
+		pairs += [(stage, duration, new['stages'].get(stage, 0.0)) for stage, duration in base['stages'].items()]
+		for stage, base_duration, new_duration in pairs:
+			if new_duration - base_duration < min_duration:
+				continue
+			if new_duration > base_duration * stage_thresholds.get(stage, threshold):
+				regressions.append((size, stage, base_duration, new_duration))
+	return regressions
+
+def main():
+	args = parse_args(get_script_args())
+
+	if args.compare:
+		with open(args.compare) as f:
+			results = json.load(f)
+	else:
+		if not bpy:
+			print("Benchmarks must be run inside Blender. Use --compare to compare existing results.")
+			return False
+		results = run_benchmarks(args)
+		text = json.dumps(results, indent=4)
+		if args.output:
+			with open(args.output, 'w') as f:
+				f.write(text)
+		else:
+			print(text)
+
+	if not args.baseline:
+		return True
+
+	if args.update_baseline or not os.path.exists(args.baseline):
+		with open(args.baseline, 'w') as f:
+			f.write(json.dumps(results, indent=4))
+		print(f"Baseline written to {args.baseline}")
+		return True
+
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	regressions = find_regressions(results, baseline, args.threshold, parse_stage_thresholds(args.stage_threshold), args.min_duration)
+	for size, stage, base_duration, new_duration in regressions:
+		print(f"REGRESSION: {size} bones, {stage}: {base_duration:.3f}s -> {new_duration:.3f}s ({new_duration / max(base_duration, 1e-6):.2f}x)")
+	if not regressions:
+		print("No regressions compared to the baseline.")
+	return not regressions
+
+if __name__ == "__main__":
+	success = main()
+	if not success:
+		sys.exit(1)
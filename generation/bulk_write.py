@@ -0,0 +1,99 @@
+"""
+Read and write bone properties of many bones at once.
+
+Setting properties one bone at a time goes through RNA for every single
+value, which adds up on rigs with thousands of bones. These functions
+handle properties that the generator itself writes, for all bones at once
+with foreach_get() and foreach_set() where possible.
+"""
+
+from typing import Dict, List, Any
+import numpy as np
+
+def scale_custom_shapes(pose_bones, factors: Dict[int, float]):
+	"""Multiply the custom shape scale of pose bones by a factor per pose bone
+	index, except for bones whose shape is already scaled by the bone's length."""
+	if not factors:
+		return
+	count = len(pose_bones)
+	use_bone_size = np.zeros(count, dtype=np.bool_)
+	pose_bones.foreach_get('use_custom_shape_bone_size', use_bone_size)
+	shape_scale = np.zeros(count * 3, dtype=np.float32)
+	pose_bones.foreach_get('custom_shape_scale_xyz', shape_scale)
+
+	multipliers = np.ones(count, dtype=np.float32)
+	multipliers[list(factors.keys())] = list(factors.values())
+	multipliers[use_bone_size] = 1
+	shape_scale = shape_scale.reshape(count, 3) * multipliers[:, np.newaxis]
+	pose_bones.foreach_set('custom_shape_scale_xyz', shape_scale.ravel())
+
+def get_property_defaults(struct_rna) -> Dict[str, Any]:
+	"""Return the default value of each property of a struct, eg. a PropertyGroup."""
+	defaults = {}
+	for prop in struct_rna.properties:
+		if prop.identifier == 'rna_type' or prop.type == 'COLLECTION' or prop.is_readonly:
+			continue
+		if prop.type == 'POINTER':
+			defaults[prop.identifier] = None
+		elif prop.type == 'ENUM':
+			defaults[prop.identifier] = set(prop.default_flag) if prop.is_enum_flag else prop.default
+		elif getattr(prop, 'is_array', False):
+			defaults[prop.identifier] = tuple(prop.default_array)
+		else:
+			defaults[prop.identifier] = prop.default
+	return defaults
+
+def to_comparable(value):
+	if isinstance(value, (str, set)) or not hasattr(value, '__len__'):
+		return value
+	return tuple(value)
+
+def transfer_bone_property_group(old_rig, new_rig, group_attr: str, enabled_attr="") -> List[str]:
+	"""Copy a PropertyGroup that an add-on registers on pose bones, eg. bone_gizmo,
+	to the bones of the same name on another rig. Optionally, also copy a boolean
+	pose bone property that toggles the add-on's behaviour, eg. enable_bone_gizmo.
+
+	Only bones where that's enabled or whose group has non-default values are
+	copied, and only the non-default values are written.
+	Return the names of such bones that don't exist on the new rig."""
+	old_bones = old_rig.pose.bones
+	new_bones = new_rig.pose.bones
+	if not old_bones:
+		return []
+	new_indices = {name : i for i, name in enumerate(new_bones.keys())}
+
+	if enabled_attr:
+		old_enabled = np.zeros(len(old_bones), dtype=np.bool_)
+		old_bones.foreach_get(enabled_attr, old_enabled)
+		new_enabled = np.zeros(len(new_bones), dtype=np.bool_)
+		new_bones.foreach_get(enabled_attr, new_enabled)
+
+	defaults = get_property_defaults(getattr(old_bones[0], group_attr).bl_rna)
+	missing_bones = []
+	for old_index, old_pb in enumerate(old_bones):
+		new_index = new_indices.get(old_pb.name)
+		is_enabled = False
+		if enabled_attr:
+			is_enabled = old_enabled[old_index]
+			if new_index is not None:
+				new_enabled[new_index] = is_enabled
+
+		old_group = getattr(old_pb, group_attr)
+		values = {}
+		for key, default in defaults.items():
+			value = getattr(old_group, key)
+			if to_comparable(value) != default:
+				values[key] = value
+		if not values and not is_enabled:
+			continue
+		if new_index is None:
+			missing_bones.append(old_pb.name)
+			continue
+
+		new_group = getattr(new_bones[new_index], group_attr)
+		for key, value in values.items():
+			setattr(new_group, key, value)
+
+	if enabled_attr:
+		new_bones.foreach_set(enabled_attr, new_enabled)
+	return missing_bones
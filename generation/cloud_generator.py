@@ -1,11 +1,12 @@
 from typing import List, Dict, Tuple
 
-import bpy, sys, os, traceback, time, shutil
+import bpy, sys, os, traceback, time, shutil, json, hashlib
+import numpy as np
 from bpy.types import Object
 from mathutils import Matrix, Vector
-from bpy.props import BoolProperty, PointerProperty, CollectionProperty, IntProperty
+from bpy.props import BoolProperty, PointerProperty, CollectionProperty, IntProperty, StringProperty
+from bpy_extras.io_utils import ExportHelper
 
-from bone_selection_sets import from_json, to_json
 from datetime import datetime
 
 from rigify.generate import Generator, select_object
@@ -19,9 +20,9 @@ from rigify.utils.naming import ORG_PREFIX, MCH_PREFIX, DEF_PREFIX, change_name_
 
 from rigify.utils.errors import MetarigError
 from rigify.utils.bones import new_bone
-from rigify.utils.mechanism import refresh_all_drivers
+from rigify.utils.mechanism import refresh_all_drivers, refresh_drivers
 from rigify.utils.collections import ensure_collection
-from rigify.base_rig import BaseRig
+from rigify.base_rig import BaseRig, GenerateCallbackHost
 from rigify.utils.action_layers import ActionLayerBuilder
 
 from ..rig_features.ui import redraw_viewport, is_cloud_metarig
@@ -33,6 +34,12 @@ from ..rig_features.mechanism import get_object_scalar
 
 from .troubleshooting import CloudRigLogEntry, CloudLogManager
 from .naming import CloudNameManager
+from .fingerprint import hash_metarig_bones, get_generation_hash
+from .driver_index import DriverKey, index_bone_drivers
+from .widget_library import widget_library
+from .vertex_groups import count_vertex_group_weights
+from .rig_order import RigScheduler, RigOrderCycleError
+from .bulk_write import scale_custom_shapes, transfer_bone_property_group
 
 from ..operators.assign_bone_layers import init_cloudrig_layers
 from ..versioning import cloud_metarig_version
@@ -86,6 +93,18 @@ class CloudRigProperties(bpy.types.PropertyGroup):
 		,override	 = {'LIBRARY_OVERRIDABLE'}
 	)
 
+	full_refresh: BoolProperty(
+		name		 = "Full Refresh"
+		,description = "After generation, refresh every driver in the file and every constraint of the rig, rather than only the ones affected by the generated rig. Slower, but may help if something doesn't evaluate correctly until the file is reloaded"
+		,default	 = False
+	)
+
+	profile_generation: BoolProperty(
+		name		 = "Profile Generation"
+		,description = "Report the rig components that took the longest to generate in the Generation Log"
+		,default	 = False
+	)
+
 	auto_setup_gizmos: BoolProperty(
 		name		 = "Auto Setup Gizmos (EXPERIMENTAL)"
 		,description = "Experiment with the initial BoneGizmo addon integration"
@@ -102,98 +121,260 @@ class CloudRigProperties(bpy.types.PropertyGroup):
 	ui_bone_sets: CollectionProperty(type=UIBoneSet)
 	bone_set_use_grid_layout: BoolProperty(name="Use Grid Layout", default=True, description="Switch the list display between a compact grid and a detailed list")
 
+def get_cloudrig_version() -> str:
+	"""Return the version of the CloudRig feature set, so that updating CloudRig
+	invalidates the generation hash of previously generated rigs."""
+	feature_set = sys.modules.get(__package__.rsplit(".", 1)[0])
+	version = getattr(feature_set, 'rigify_info', {}).get('version', ())
+	return f"{tuple(version)}-{cloud_metarig_version}"
+
+def is_generation_up_to_date(metarig: Object, bones_hash="") -> bool:
+	"""Return whether generating the metarig would give the same result as
+	its current target rig, in which case generation can be skipped.
+	The result of hash_metarig_bones() can be passed in, if it's already known."""
+	rig = metarig.data.rigify_target_rig
+	if not rig or 'generation_hash' not in rig.data:
+		return False
+	if metarig.mode == 'EDIT' or metarig.data.rigify_force_widget_update or metarig.get('failed_rig'):
+		return False
+	generation_hash = get_generation_hash(metarig, bones_hash or hash_metarig_bones(metarig), get_cloudrig_version())
+	return rig.data['generation_hash'] == generation_hash
+
 def is_cloud_rig_type(rig_type_name: str):
 	return  rig_type_name != "" and \
 			('cloud' in rig_type_name or \
 			'sprite_fright' in rig_type_name)
 
-# def load_script(file_path="", file_name="cloudrig.py", rigify_rig_basename="123", datablock=None) -> bpy.types.Text:
-#     """Load a text file into a text datablock, enable register checkbox and execute it.
-#     Also run an optional search and replace on the file content.
-#     """
-	
-#     if datablock:
-#         text = datablock
-#     else:
-#         # Check if it already exists
-#         text = bpy.data.texts.get(file_name)
-#         # If not, create it.
-#         if not text:
-#             text = bpy.data.texts.new(name=f"{rigify_rig_basename}.py")
-#             text.use_fake_user = False
-
-#     text.clear()
-#     text.use_module = True
-
-#     if file_path == "":
-#         file_path = os.path.dirname(os.path.realpath(__file__))
-
-#     readfile = open(os.path.join(file_path, file_name), 'r')
-#     for line in readfile:
-#         text.write(line)
-#     readfile.close()
-
-#     # Pass the file name to the executed script's namespace
-#     exec(text.as_string(), {"__file_name__": file_name})
-
-#     return text
-
-def load_script(file_path="", file_name="cloudrig.py", rigify_rig_basename="123", datablock=None) -> bpy.types.Text:
+# Name of the text datablock of the rig UI script, shared by all CloudRig rigs.
+UI_SCRIPT_NAME = "cloudrig.py"
+
+# Hashes of the script each text datablock held when it was executed during this session.
+executed_scripts: Dict[str, str] = {}
+# Compiled code of executed scripts, by hash.
+compiled_scripts: Dict[str, object] = {}
+
+def load_script(file_path="", file_name="cloudrig.py", datablock_name="cloudrig.py") -> bpy.types.Text:
     """Load a text file into a text datablock, enable register checkbox and execute it.
-    Dynamically rename the datablock to match the rigify_rig_basename.
+    If the datablock already holds the same script and was executed during this
+    session, it's neither re-written nor executed again.
     """
 
-    # Determine the name for the Blender text datablock
-    datablock_name = f"{rigify_rig_basename}.py" if rigify_rig_basename else "CloudRig.py"
-
-    if datablock:
-        # Use the provided datablock, if already given
-        text = datablock
-        text.name = datablock_name  # Rename the datablock
-    else:
-        # Check if it already exists
-        text = bpy.data.texts.get(datablock_name)
-        if not text:
-            # Create a new datablock if it doesn't exist
-            text = bpy.data.texts.new(name=datablock_name)
-            text.use_fake_user = False
-
-    # Clear any existing content in the text datablock
-    text.clear()
+    text = bpy.data.texts.get(datablock_name)
+    if not text:
+        # Create a new datablock if it doesn't exist
+        text = bpy.data.texts.new(name=datablock_name)
+        text.use_fake_user = False
     text.use_module = True
 
     # Fallback to the current script directory if no file_path is provided
     if not file_path:
         file_path = os.path.dirname(os.path.realpath(__file__))
 
-    # Load the content of the external .py file into the text datablock
     with open(os.path.join(file_path, file_name), 'r') as readfile:
-        for line in readfile:
-            text.write(line)
+        source = readfile.read()
+    script_hash = hashlib.sha1((datablock_name + "\n" + source).encode()).hexdigest()
+
+    # Only replace the content of the text datablock when it changed
+    if text.get('cloudrig_script_hash') != script_hash or text.as_string() != source:
+        text.from_string(source)
+        text['cloudrig_script_hash'] = script_hash
+    elif executed_scripts.get(text.name) == script_hash:
+        return text
 
-    # Pass the datablock name to the executed script's namespace
-    exec(text.as_string(), {"__file_name__": datablock_name})
+    code = compiled_scripts.get(script_hash)
+    if not code:
+        code = compiled_scripts[script_hash] = compile(source, datablock_name, 'exec')
+
+    # Pass the datablock name and a version stamp to the executed script's namespace
+    exec(code, {"__file_name__": datablock_name, "__cloudrig_ui_version__": script_hash})
+    executed_scripts[text.name] = script_hash
 
     return text
 
 
 
-class Timer:
+class GenerationMetrics:
+	"""Measure the duration of each generation stage with a monotonic clock.
+	The results are kept as a structured record, which is stored on the
+	generated rig so it can be compared across generations and exported as JSON.
+	"""
 	def __init__(self):
-		self.start_time = self.last_time = time.time()
-
-	def tick(self, string):
-		t = time.time()
-		print(string + "%.3f" % (t - self.last_time))
+		self.start_time = self.last_time = time.perf_counter()
+		self.stages: Dict[str, float] = {}
+		self.mode_switches = 0
+		# Time spent by each rig component, keyed by base bone name.
+		self.components: Dict[str, dict] = {}
+
+	def tick(self, stage_name: str) -> float:
+		"""Attribute the time since the previous tick to a stage."""
+		t = time.perf_counter()
+		duration = t - self.last_time
+		self.stages[stage_name] = self.stages.get(stage_name, 0.0) + duration
+		print(f"{stage_name}: {duration:.3f}")
 		self.last_time = t
+		return duration
+
+	def add_component_time(self, base_bone: str, rig_type: str, stage_name: str, duration: float):
+		"""Attribute time spent in a single stage to a single rig component."""
+		component = self.components.get(base_bone)
+		if not component:
+			component = self.components[base_bone] = {'type' : rig_type, 'total' : 0.0, 'stages' : {}}
+		component['total'] += duration
+		component['stages'][stage_name] = component['stages'].get(stage_name, 0.0) + duration
 
-	def total(self, string="Total: "):
-		t = time.time()
-		print(string + "%.3f" %(t - self.start_time))
+	def slowest_components(self, count=5) -> List[Tuple[str, dict]]:
+		"""Return the (base bone, timings) pairs of the slowest rig components."""
+		return sorted(self.components.items(), key=lambda item: item[1]['total'], reverse=True)[:count]
+
+	@property
+	def total(self) -> float:
+		return self.last_time - self.start_time
+
+	def as_dict(self, generator=None) -> dict:
+		metrics = {
+			'version' : cloud_metarig_version
+			,'date' : datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+			,'total' : self.total
+			,'mode_switches' : self.mode_switches
+			,'stages' : dict(self.stages)
+			,'components' : {base_bone : component for base_bone, component in self.slowest_components(len(self.components))}
+		}
+		if generator:
+			metrics['metarig'] = generator.metarig.name
+			metrics['bone_count'] = len(generator.obj.data.bones)
+			metrics['rig_count'] = len(generator.rig_list)
+		return metrics
+
+	def store(self, generator):
+		"""Save the metrics as a custom property of the generated rig's data."""
+		generator.obj.data['generation_metrics'] = self.as_dict(generator)
+
+def generation_metrics_to_json(rig: Object) -> str:
+	"""Return the metrics of the last generation of a rig as a JSON string."""
+	metrics = rig.data.get('generation_metrics')
+	if not metrics:
+		return ""
+	return json.dumps(metrics.to_dict(), indent=4)
+
+class BoneInfoList(list):
+	"""List of all BoneInfos of all rigs, which also indexes them by name,
+	so they can be found without searching through every BoneSet.
+	When several BoneInfos have the same name, the first one is indexed."""
+
+	def __init__(self, *args):
+		super().__init__(*args)
+		self.reindex()
+
+	def reindex(self):
+		self.by_name = {}
+		# Number of BoneInfos with each name.
+		self.name_counts = {}
+		for bi in self:
+			self.by_name.setdefault(bi.name, bi)
+			self.name_counts[bi.name] = self.name_counts.get(bi.name, 0) + 1
+
+	def get(self, name: str):
+		bi = self.by_name.get(name)
+		if bi is not None and bi.name != name:
+			# The BoneInfo was renamed without going through rename().
+			self.reindex()
+			bi = self.by_name.get(name)
+		return bi
+
+	def index_first(self, name: str, exclude=None):
+		"""Index the first BoneInfo with a name. Only needed when several BoneInfos have that name."""
+		self.by_name.pop(name, None)
+		for bi in self:
+			if bi.name == name and bi is not exclude:
+				self.by_name[name] = bi
+				break
+
+	def add_name(self, bi, at_end=True):
+		"""Index a BoneInfo that was just added to the list."""
+		count = self.name_counts[bi.name] = self.name_counts.get(bi.name, 0) + 1
+		if count == 1 or at_end:
+			self.by_name.setdefault(bi.name, bi)
+		else:
+			self.index_first(bi.name)
+
+	def discard_name(self, bi):
+		"""Un-index a BoneInfo that is being removed from the list, or renamed."""
+		name = bi.name
+		count = self.name_counts.get(name, 0) - 1
+		if count > 0:
+			self.name_counts[name] = count
+			if self.by_name.get(name) is bi:
+				self.index_first(name, exclude=bi)
+		else:
+			self.name_counts.pop(name, None)
+			if self.by_name.get(name) is bi:
+				del self.by_name[name]
+
+	def rename(self, bi, new_name: str):
+		self.discard_name(bi)
+		bi.name = new_name
+		self.add_name(bi, at_end=False)
+
+	def append(self, bi):
+		super().append(bi)
+		self.add_name(bi)
+
+	def extend(self, bone_infos):
+		bone_infos = list(bone_infos)
+		super().extend(bone_infos)
+		for bi in bone_infos:
+			self.add_name(bi)
+
+	def __iadd__(self, bone_infos):
+		self.extend(bone_infos)
+		return self
+
+	def insert(self, index, bi):
+		super().insert(index, bi)
+		self.add_name(bi, at_end=False)
+
+	def remove(self, bi):
+		super().remove(bi)
+		self.discard_name(bi)
+
+	def pop(self, index=-1):
+		bi = super().pop(index)
+		self.discard_name(bi)
+		return bi
+
+	def clear(self):
+		super().clear()
+		self.by_name = {}
+		self.name_counts = {}
+
+	def __setitem__(self, index, value):
+		if isinstance(index, slice):
+			super().__setitem__(index, value)
+			self.reindex()
+			return
+		old = self[index]
+		super().__setitem__(index, value)
+		self.discard_name(old)
+		self.add_name(value, at_end=False)
+
+	def __delitem__(self, index):
+		if isinstance(index, slice):
+			super().__delitem__(index)
+			self.reindex()
+			return
+		old = self[index]
+		super().__delitem__(index)
+		self.discard_name(old)
+
+# Minimum number of vertices in a vertex group for automatically setting up a gizmo with it.
+GIZMO_MIN_VERTICES = 8
 
 class CloudGenerator(Generator):
-	def __init__(self, context, metarig):
+	def __init__(self, context, metarig, bones_hash=""):
 		super().__init__(context, metarig)
+		# Hash of the metarig's bones, if it was already computed before generation. See hash_metarig_bones().
+		self.bones_hash = bones_hash
+		self.metrics = GenerationMetrics()
 		self.params = metarig.data	# Generator parameters are stored in rig data.
 
 		# try:
@@ -216,7 +397,9 @@ class CloudGenerator(Generator):
 		# List that stores a reference to all BoneInfo instances of all rigs.
 		# IMPORTANT: This should not be a BoneSet, just a regular list. Otherwise the LinkedList behaviour gets all messed up!
 		# Each BoneInfo should only exist in a single BoneSet!
-		self.bone_infos = []
+		self.bone_infos = BoneInfoList()
+		# When Blender runs with --debug, find_bone_info() results are checked against a search through every BoneSet.
+		self.debug_bone_info_index = bpy.app.debug
 		# List that stores a reference to all BoneSets of all rigs.
 		self.bone_sets: List[BoneSet] = []
 		# Default kwargs that are passed in to every created BoneInfo
@@ -241,39 +424,46 @@ class CloudGenerator(Generator):
 		# Check if Selection Sets addon is enabled
 		self.do_sel_sets = check_addon(context, 'bone_selection_sets')
 
+	def instantiate_rig_tree(self, halt_on_missing=False):
+		super().instantiate_rig_tree(halt_on_missing)
+		self.index_rigs()
+
 	def cloudrig_reorder_rigs(self, rig_list):
 		"""Some rig types need special treatment in regards to where they are in
-		the rig generation order."""
-		from ..rigs.cloud_tweak import CloudTweakRig
-		from ..rigs.cloud_chain_anchor import CloudChainAnchorRig
-		from ..rigs.cloud_face_chain import CloudFaceChainRig
-		from ..rigs.cloud_jaw import CloudJawRig
-
-		first_face_idx = -1
-		for i, rig in enumerate(rig_list[:]):
-			if isinstance(rig, CloudTweakRig) or isinstance(rig, CloudChainAnchorRig):
-				# cloud_tweak rigs should be generated last.
-				rig_list.remove(rig)
-				rig_list.append(rig)
-			if isinstance(rig, CloudFaceChainRig) and first_face_idx == -1:
-				first_face_idx = i
-
-		for i, rig in enumerate(rig_list[:]):
-			if isinstance(rig, CloudJawRig):
-				for param_name in {'CR_jaw_lower_face_bone', 'CR_jaw_squash_bone', 'CR_jaw_chin_bone', 'CR_jaw_mouth_bone', 'CR_jaw_teeth_follow', 'CR_jaw_teeth_upper_bone', 'CR_jaw_teeth_lower_bone'}:
-					bone_name = getattr(rig.params, param_name)
-					dependency_rig = self.get_rig_by_name(bone_name)
-					if dependency_rig:
-						rig_list.remove(dependency_rig)
-						rig_list.insert(i-1, dependency_rig)
-
-		for rig in rig_list[:]:
-			if isinstance(rig, CloudChainAnchorRig):
-				# cloud_chain_anchor pushed before the first cloud_face_chain.
-				rig_list.remove(rig)
-				rig_list.insert(first_face_idx, rig)
+		the rig generation order. Sort the rigs according to the ordering rules
+		declared by their rig types, see rig_order.py."""
+		scheduler = RigScheduler(rig_list, self.get_rig_by_name)
+		try:
+			order = scheduler.sort()
+		except RigOrderCycleError as exc:
+			for cycle in exc.cycles:
+				for rig in cycle:
+					self.logger.log_error("Rig Order Cycle"
+						,owner_bone  = rig.base_bone
+						,description = f'The execution order rules of this rig component contradict those of another one, so its execution order could not be adjusted. Rigs involved: {", ".join([r.base_bone for r in cycle])}'
+					)
+			order = rig_list[:]
+
+		rig_list[:] = order
+		# Groups of rigs that don't depend on each other, in execution order.
+		self.rig_order_groups = scheduler.get_groups(order)
+		self.index_rigs()
 
 	def find_bone_info(self, name):
+		bi = self.bone_infos.get(name)
+		if not self.debug_bone_info_index:
+			return bi
+
+		expected = self.find_bone_info_in_bone_sets(name)
+		if bi is not expected:
+			self.logger.log_bug("BoneInfo index mismatch"
+				,trouble_bone = name
+				,description = f'Looking up BoneInfo "{name}" by name gave a different result than searching all BoneSets.'
+			)
+		return expected
+
+	def find_bone_info_in_bone_sets(self, name):
+		"""Slow but sure way to find a BoneInfo, used to verify the name index."""
 		for rig in self.rig_list:
 			if hasattr(rig, "bone_sets"):
 				for bs in list(rig.bone_sets.values()):
@@ -287,41 +477,57 @@ class CloudGenerator(Generator):
 
 	def rigify_assign_layers(self):
 		""" Rigify compatibility function: Assign ORG/MCH/DEF layers, only to non-CloudRig types. """
-		cloudrig_bones = []
+		cloudrig_bones = set()
 		for rig in self.rig_list:
 			if "cloud" in str(type(rig)):
 				for bone_set in list(rig.bone_sets.values()):
 					for bone_info in bone_set:
-						cloudrig_bones.append(bone_info.name)
+						cloudrig_bones.add(bone_info.name)
 
-		pbones = [pb for pb in self.obj.pose.bones if pb.name not in cloudrig_bones]
+		bones = self.obj.data.bones
+		count = len(bones)
+		if count == 0:
+			return
+		names = np.array(bones.keys())
+		rigify_mask = np.array([name not in cloudrig_bones for name in names], dtype=np.bool_)
+
+		use_deform = np.zeros(count, dtype=np.bool_)
+		bones.foreach_get('use_deform', use_deform)
+		layers = np.zeros(count * 32, dtype=np.bool_)
+		bones.foreach_get('layers', layers)
+		layers = layers.reshape(count, 32)
+		bbone_x = np.zeros(count, dtype=np.float32)
+		bones.foreach_get('bbone_x', bbone_x)
+		bbone_z = np.zeros(count, dtype=np.float32)
+		bones.foreach_get('bbone_z', bbone_z)
+		lengths = np.zeros(count, dtype=np.float32)
+		bones.foreach_get('length', lengths)
 
 		# Every bone that has a name starting with "DEF-" make deforming.  All the
 		# others make non-deforming.
-		for pbone in pbones:
-			bone = pbone.bone
-			name = bone.name
-			layers = None
-
-			bone.use_deform = name.startswith(DEF_PREFIX)
-
-			# Move all the original bones to their layer.
-			if name.startswith(ORG_PREFIX):
-				layers = ORG_LAYER
-			# Move all the bones with names starting with "MCH-" to their layer.
-			elif name.startswith(MCH_PREFIX):
-				layers = MCH_LAYER
-			# Move all the bones with names starting with "DEF-" to their layer.
-			elif name.startswith(DEF_PREFIX):
-				layers = DEF_LAYER
-
-			if layers is not None:
-				bone.layers = layers
-
-				# Remove custom shapes from non-control bones
-				pbone.custom_shape = None
-
-			bone.bbone_x = bone.bbone_z = bone.length * 0.05
+		is_def = np.char.startswith(names, DEF_PREFIX)
+		use_deform[rigify_mask] = is_def[rigify_mask]
+
+		# Move all the original bones to their layer, then the bones with names
+		# starting with "MCH-", then the bones with names starting with "DEF-".
+		is_org = np.char.startswith(names, ORG_PREFIX)
+		is_mch = np.char.startswith(names, MCH_PREFIX) & ~is_org
+		is_def &= ~(is_org | is_mch)
+		has_layer = rigify_mask & (is_org | is_mch | is_def)
+		for mask, layer in ((is_org, ORG_LAYER), (is_mch, MCH_LAYER), (is_def, DEF_LAYER)):
+			layers[rigify_mask & mask] = layer
+
+		bbone_x[rigify_mask] = bbone_z[rigify_mask] = lengths[rigify_mask] * 0.05
+
+		bones.foreach_set('use_deform', use_deform)
+		bones.foreach_set('layers', layers.ravel())
+		bones.foreach_set('bbone_x', bbone_x)
+		bones.foreach_set('bbone_z', bbone_z)
+
+		# Remove custom shapes from non-control bones
+		pose_bones = self.obj.pose.bones
+		for name in names[has_layer]:
+			pose_bones[str(name)].custom_shape = None
 
 	def update_bone_set_ui_info(self):
 		"""Keep in sync the bone_sets CollectionProperty stored in the generator
@@ -364,20 +570,30 @@ class CloudGenerator(Generator):
 
 		rig_name = "NEW-" + final_name
 
-		with context.temp_override(object=metarig, selected_objects=[metarig]):
-			bpy.ops.object.duplicate()
-		obj = context.view_layer.objects.active	# NOTE: Oddly, this is different from context.object.
+		# Copy the metarig through the data API rather than bpy.ops.object.duplicate(),
+		# so no operator, undo or selection overhead is involved, and no UI context is needed.
+		# ID.copy() remaps references to the metarig within the copy, eg. of constraints and drivers.
+		obj = metarig.copy()
+		obj.data = metarig.data.copy()
 		obj.name = rig_name
-		for pb in obj.pose.bones:
-			if pb.rigify_type not in {'cloud_copy', 'basic.raw_copy'}:
-				pb.name = "ORG-"+pb.name
-		# self._Generator__rename_org_bones(obj)
 		obj.data.name = "Data_" + final_name
+		for coll in metarig.users_collection:
+			coll.objects.link(obj)
+		metarig.select_set(False)
+		obj.select_set(True)
+		context.view_layer.objects.active = obj
+
+		# Bones have to be renamed one by one, since renaming a bone also
+		# updates the constraints and drivers that reference it.
+		rename_bones = [pb.name for pb in obj.pose.bones if pb.rigify_type not in {'cloud_copy', 'basic.raw_copy'}]
+		bones = obj.data.bones
+		for name in rename_bones:
+			bones[name].name = "ORG-"+name
+		# self._Generator__rename_org_bones(obj)
 
 		# Remove all custom properties
 		for db in [obj, obj.data]:
-			for key, value in list(db.items()):
-				del db[key]
+			db.id_properties_clear()
 
 		# Adding the rig_id necessary to not display metarig UI on generated rigs.
 		# XXX UPSTREAM: Metarigs should be marked rather than non-metarigs!
@@ -453,24 +669,45 @@ class CloudGenerator(Generator):
 			self.root_parent = mechanism.create_parent_bone(self.root_bone, self.root_parent_set)
 
 	def ensure_bone_groups(self):
-		# Wipe any existing bone groups from the target rig.
-		if self.obj.pose:
-			for bone_group in self.obj.pose.bone_groups:
-				self.obj.pose.bone_groups.remove(bone_group)
-
+		"""Make the target rig's bone groups match the Bone Sets.
+		Existing groups are updated in-place instead of being re-created, so
+		bones keep their group assignments, and only groups that no Bone Set
+		uses anymore are removed. Each group is only written once, even if
+		several Bone Sets use it."""
+		# Bone Sets by the name of the bone group they use.
+		sets_by_group: Dict[str, List[BoneSet]] = {}
 		for bone_set in self.bone_sets:
-			meta_bg = bone_set.ensure_bone_group(self.metarig, overwrite=False)
-			if meta_bg:
-				bone_set.normal = meta_bg.colors.normal[:]
-				bone_set.select = meta_bg.colors.select[:]
-				bone_set.active = meta_bg.colors.active[:]
-			if self.params.rigify_colors_lock:
-				bone_set.select = self.params.rigify_selection_colors.select
-				bone_set.active = self.params.rigify_selection_colors.active
-
-			bone_set.ensure_bone_group(self.obj, overwrite=True)
+			sets_by_group.setdefault(bone_set.bone_group, []).append(bone_set)
+
+		# Groups that already exist on the target rig, eg. copied from the metarig.
+		rig_groups = {bg.name : bg for bg in self.obj.pose.bone_groups} if self.obj.pose else {}
+
+		for group_name, bone_sets in sets_by_group.items():
+			meta_bg = bone_sets[0].ensure_bone_group(self.metarig, overwrite=False)
+			for bone_set in bone_sets:
+				if meta_bg:
+					bone_set.normal = meta_bg.colors.normal[:]
+					bone_set.select = meta_bg.colors.select[:]
+					bone_set.active = meta_bg.colors.active[:]
+				if self.params.rigify_colors_lock:
+					bone_set.select = self.params.rigify_selection_colors.select
+					bone_set.active = self.params.rigify_selection_colors.active
+
+			# Always write the group, since BoneSet decides what to write, eg. its color set.
+			# Overwriting an existing group keeps it, along with the bones assigned to it.
+			rig_groups.pop(group_name, None)
+			bone_sets[-1].ensure_bone_group(self.obj, overwrite=True)
+
+		# Remove groups that no Bone Set uses.
+		for bone_group in rig_groups.values():
+			self.obj.pose.bone_groups.remove(bone_group)
 
 	def ensure_widget(self, widget_name):
+		# Each widget only needs to be loaded (or re-loaded, with Force Widget Update) once per generation.
+		wgt = self.ensured_widgets.get(widget_name)
+		if wgt:
+			return wgt
+
 		wgt = cloud_widgets.ensure_widget(
 			widget_name
 			,overwrite = self.params.rigify_force_widget_update
@@ -480,6 +717,11 @@ class CloudGenerator(Generator):
 			self.logger.log_bug("Failed to create widget"
 				,description = f"Failed to load widget named '{widget_name}'."
 			)
+			return wgt
+
+		# Use the same mesh as any other widget with the same shape.
+		widget_library.share_mesh(wgt)
+		self.ensured_widgets[widget_name] = wgt
 		return wgt
 
 	def add_to_widget_collection(self, widget_ob):
@@ -512,26 +754,29 @@ class CloudGenerator(Generator):
 
 		return test_action
 
+	def index_rigs(self):
+		"""Build lookup tables of rig components, which have to be rebuilt
+		whenever self.rig_list changes."""
+		self.rigs_by_base_bone: Dict[str, BaseRig] = {}
+		self.rigs_by_name: Dict[str, BaseRig] = {}
+		self.rig_children: Dict[BaseRig, List[BaseRig]] = {}
+		for rig in self.rig_list:
+			self.rigs_by_base_bone.setdefault(rig.base_bone, rig)
+			self.rigs_by_name.setdefault(rig.base_bone.replace("ORG-", ""), rig)
+			self.rig_children.setdefault(rig.rigify_parent, []).append(rig)
+
 	def get_symmetry_rig(self, rig: BaseRig) -> BaseRig:
 		"""Find another rig in the generator with the opposite name for rig.base_bone."""
 		flipped_name = self.naming.flipped_name(rig.base_bone)
 		if flipped_name == rig.base_bone: return
 
-		for other_rig in self.rig_list:
-			if other_rig.base_bone == flipped_name:
-				return other_rig
+		return self.rigs_by_base_bone.get(flipped_name)
 
 	def get_rig_children(self, rig: BaseRig):
-		children = []
-		for r in self.rig_list:
-			if r.rigify_parent == rig:
-				children.append(r)
-		return children
+		return list(self.rig_children.get(rig, []))
 
 	def get_rig_by_name(self, rig_name: str) -> BaseRig:
-		for r in self.rig_list:
-			if r.base_bone.replace("ORG-", "") == rig_name:
-				return r
+		return self.rigs_by_name.get(rig_name)
 
 	def create_test_animation(self):
 		"""Generate deformation test animation.
@@ -595,7 +840,7 @@ class CloudGenerator(Generator):
 					,trouble_bone = bi.name
 					,description = f'Bone name "{bi.name}" was already taken, fell back to "{new_name}" instead. This is a bug unless your bone names are around 60 characters long.'
 				)
-				bi.name = new_name
+				self.bone_infos.rename(bi, new_name)
 			self.bone_owners[new_name] = None
 
 		super().invoke_generate_bones()
@@ -604,9 +849,9 @@ class CloudGenerator(Generator):
 		super().invoke_parent_bones()
 
 		# Write edit bone data for BoneInfos.
+		edit_bones = self.obj.data.edit_bones
 		for bi in self.bone_infos:
-			edit_bone = self.obj.data.edit_bones.get(bi.name)
-			bi.write_edit_data(self, edit_bone, self.context)
+			bi.write_edit_data(self, edit_bones.get(bi.name), self.context)
 
 		# Parent parent-less bones to the root bone, if there is one.
 		if self.root_bone:
@@ -615,8 +860,12 @@ class CloudGenerator(Generator):
 			self._Generator__parent_bones_to_root()
 
 	def invoke_configure_bones(self):
+		# Write pose bone data for BoneInfos.
+		pose_bones = self.obj.pose.bones
+		indices = {name : i for i, name in enumerate(pose_bones.keys())}
+		shape_scales: Dict[int, float] = {}
 		for bi in self.bone_infos:
-			pose_bone = self.obj.pose.bones.get(bi.name)
+			pose_bone = pose_bones.get(bi.name)
 			if not pose_bone:
 				self.logger.log("Bone creation failed"
 					,owner_bone   = bi.owner_rig.base_bone
@@ -625,10 +874,12 @@ class CloudGenerator(Generator):
 				)
 				continue
 
-			# Scale bone shape based on B-Bone scale
 			bi.write_pose_data(pose_bone)
-			if not pose_bone.use_custom_shape_bone_size and bi.use_custom_shape_bbone_scaling:
-				pose_bone.custom_shape_scale_xyz *= bi.bbone_width * 10 * self.scale
+			if bi.use_custom_shape_bbone_scaling:
+				shape_scales[indices[bi.name]] = bi.bbone_width * 10 * self.scale
+
+		# Scale bone shape based on B-Bone scale
+		scale_custom_shapes(pose_bones, shape_scales)
 
 		super().invoke_configure_bones()
 
@@ -637,55 +888,55 @@ class CloudGenerator(Generator):
 
 		# Rigify automatically parents bones that have no parent to the root bone.
 		# We want to undo this when the bone has an Armature constraint.
-		for eb in self.obj.data.edit_bones:
-			pb = self.obj.pose.bones.get(eb.name)
-			for c in pb.constraints:
-				if c.type=='ARMATURE' and c.enabled:
-					eb.parent = None
-					break
+		# Look for these bones again, since rigs may have parented bones during apply_bones.
+		edit_bones = self.obj.data.edit_bones
+		for bone_name in self.find_armature_constrained_bones(parented_only=False):
+			edit_bones[bone_name].parent = None
 
 	# Generation functions
 	@staticmethod
 	def map_vgroups_to_most_significant_object(
 			group_names: List[str]
 			,objects: List[Object]
+			,min_count = 0
 			) -> Dict[str, Object]:
 		"""Create a dictionary, mapping each vertex group name to the object
 		which has the vertex group with the most vertices in it.
-		This is expected to be pretty damn slow.
+		Vertex groups with fewer than min_count vertices on that object are left out.
 		"""
 		objects = [o for o in objects if o.type == 'MESH' and o.visible_get()]
+		group_names = set(group_names)
 
+		# Objects that share a mesh and vertex groups only need to be counted once.
+		mesh_counts: Dict[tuple, Dict[str, int]] = {}
 		vgroup_map = {}
-		# For each object, go through each of its vertex groups.
 		for ob in objects:
-			group_lookup = {g.index: g.name for g in ob.vertex_groups}
-			vgroup_datas = {name: [] for name in group_lookup.values() if name in group_names}
-			for v in ob.data.vertices:
-				for g in v.groups:
-					group_name = group_lookup[g.group]
-					if g.weight > 0.1 and group_name in group_names:
-						vgroup_datas[group_name].append(v.index)
+			key = (ob.data, tuple(vg.name for vg in ob.vertex_groups))
+			if key not in mesh_counts:
+				mesh_counts[key] = count_vertex_group_weights(ob)
 
-			for vg_name, vg_verts in vgroup_datas.items():
-				if (vg_name not in vgroup_map) or ( vgroup_map[vg_name][1] < len(vg_verts) ):
-					vgroup_map[vg_name] = (ob, len(vg_verts))
+			for vg_name, count in mesh_counts[key].items():
+				if vg_name not in group_names:
+					continue
+				if (vg_name not in vgroup_map) or ( vgroup_map[vg_name][1] < count ):
+					vgroup_map[vg_name] = (ob, count)
 
-		return {vg_name : tup[0] for vg_name, tup in vgroup_map.items()}
+		return {vg_name : tup[0] for vg_name, tup in vgroup_map.items() if tup[1] >= min_count}
 
 	def auto_initialize_gizmos(self):
 		"""Enable and set up custom gizmos for those bones whose BoneInfo
 		contains the neccessary data.
 		This is not done on a per-bone basis due to performance.
 		"""
-		# This function just gives terrible results.
-		return
-		rig = self.metarig.data.rigify_target_rig
-		object_candidates = rig.children[:]
+		# By now, the old rig's children were re-parented to the new rig.
+		object_candidates = self.obj.children[:]
 
 		vgroup_names = set([bi.gizmo_vgroup for bi in self.bone_infos if bi.gizmo_vgroup != ""])
 
-		vgroup_map = self.map_vgroups_to_most_significant_object(vgroup_names, object_candidates)
+		# Gizmo auto-setup used to be disabled because it gave poor results, mostly
+		# from vertex groups with a handful of stray weights. Such groups make for
+		# gizmos that are hard to see and click, so they're not mapped.
+		vgroup_map = self.map_vgroups_to_most_significant_object(vgroup_names, object_candidates, min_count=GIZMO_MIN_VERTICES)
 
 		pbones = self.obj.pose.bones
 		bone_infos = self.bone_infos
@@ -694,9 +945,8 @@ class CloudGenerator(Generator):
 			if vg_name not in vgroup_map:
 				continue
 			pb = pbones.get(bi.name)
-			if pb.enable_bone_gizmo:
+			if not pb or pb.enable_bone_gizmo:
 				continue
-			assert pb
 
 			gizmo_props = pb.bone_gizmo
 			pb.enable_bone_gizmo = True
@@ -707,41 +957,31 @@ class CloudGenerator(Generator):
 				gizmo_props.color = pb.bone_group.colors.normal[:]
 				gizmo_props.color_highlight = pb.bone_group.colors.active[:]
 
-	def map_drivers(self) -> Dict[str, Tuple[str, int]]:
+	def map_drivers(self) -> Dict[str, List[DriverKey]]:
 		"""Create a dictionary matching bone names to full data paths of drivers
-		that belong to those bones. This is to speed up loading drivers into BoneInfos."""
-		driver_map = {}
-		if not self.obj.animation_data:
-			return
-		for fc in self.obj.animation_data.drivers:
-			data_path = fc.data_path
-			if "pose.bones" in data_path:
-				bone_name = data_path.split('pose.bones["')[1].split('"]')[0]
-				if bone_name not in driver_map:
-					driver_map[bone_name] = []
-				driver_map[bone_name].append((data_path, fc.array_index))
-		return driver_map
+		that belong to those bones. This is to speed up loading drivers into BoneInfos.
+		The dictionary is empty if the rig has no drivers."""
+		return index_bone_drivers(self.obj)
 
 	def replace_old_with_new_rig(self, old_rig, new_rig, metarig):
 		"""Preserve useful user-inputted information from the previous rig,
 		then delete it and remap users to the new rig."""
 
-		# Save selection sets
+		# Preserve selection sets of previous rig.
 		if self.do_sel_sets:
-			self.context.view_layer.objects.active = old_rig
-			for selset in old_rig.selection_sets:
-				selset.is_selected = True
-			selsets = to_json(self.context)
+			dropped_bones = transfer_selection_sets(old_rig, new_rig)
+			for selset_name, bone_names in dropped_bones.items():
+				self.logger.log("Selection Set bones removed"
+					,description = f'Selection set "{selset_name}" referenced bones that no longer exist, they were removed from it: {", ".join(bone_names)}'
+				)
 
-		# Save Custom Gizmo settings
+		# Preserve Custom Gizmo settings
 		if self.use_gizmos:
-			gizmo_properties_class = bpy.types.PropertyGroup.bl_rna_get_subclass_py('BoneGizmoProperties')
-			for old_pb in old_rig.pose.bones:
-				new_pb = new_rig.pose.bones.get(old_pb.name)
-				new_pb.enable_bone_gizmo = old_pb.enable_bone_gizmo
-				for key in gizmo_properties_class.__annotations__.keys():
-					value = getattr(old_pb.bone_gizmo, key)
-					setattr(new_pb.bone_gizmo, key, value)
+			missing_bones = transfer_bone_property_group(old_rig, new_rig, 'bone_gizmo', 'enable_bone_gizmo')
+			if missing_bones:
+				self.logger.log("Gizmo settings removed"
+					,description = f'Custom gizmo settings of bones that no longer exist were not preserved: {", ".join(missing_bones)}'
+				)
 
 		# Remove old rig from all of its collections, and link the new rig to them.
 		for coll in new_rig.users_collection:
@@ -795,10 +1035,6 @@ class CloudGenerator(Generator):
 		new_rig.select_set(True)
 		self.context.view_layer.objects.active = new_rig
 
-		# Preserve selection sets of previous rig.
-		if self.do_sel_sets:
-			from_json(self.context, selsets)
-
 	def execute_custom_script(self):
 		"""Execute a text datablock to be executed after rig generation."""
 		script = self.params.rigify_finalize_script
@@ -848,36 +1084,34 @@ class CloudGenerator(Generator):
 	# 		)
 
 	def ensure_cloudrig_ui(self, metarig, rig):
-		"""Load and execute cloudrig.py rig UI script, dynamically renaming the file."""
-		
-		try:
-			rigify_rig_basename = getattr(metarig.data, "rigify_rig_basename", None)
-		except:
-			rigify_rig_basename = "CloudRig"
-			raise ValueError("metarig.data.rigify_rig_basename is not defined!")			
+		"""Load and execute cloudrig.py rig UI script. A single text datablock
+		is shared by all CloudRig rigs, each rig only stores its sidebar tab name."""
+		rigify_rig_basename = getattr(metarig.data, "rigify_rig_basename", None)
+		rig.data['cloudrig_ui_category'] = f"RIG-{rigify_rig_basename}" if rigify_rig_basename else "CloudRig"
+
+		if self.rigify_compatible:
+			old_text = metarig.data.get('cloudrig_ui')
+		else:
+			old_text = metarig.data.rigify_rig_ui
+
+		text = load_script(
+			file_path = os.path.dirname(os.path.realpath(__file__))
+			,file_name = "cloudrig.py"
+			,datablock_name = UI_SCRIPT_NAME
+		)
 
 		if self.rigify_compatible:
 			# We need to have both cloudrig.py and rigify's rig_ui.py, so
 			# let rigify use the proper script field, and put cloudrig.py
 			# in a custom property.
-			if 'cloudrig_ui' not in metarig.data:
-				metarig.data['cloudrig_ui'] = ""
-			if 'cloudrig_ui' not in rig.data:
-				rig.data['cloudrig_ui'] = ""
-
-			metarig.data['cloudrig_ui'] = rig.data['cloudrig_ui'] = load_script(
-				file_path=os.path.dirname(os.path.realpath(__file__)),
-				file_name="cloudrig.py",
-				rigify_rig_basename=rigify_rig_basename,  # Pass the basename here
-				datablock=metarig.data['cloudrig_ui']
-			)
+			metarig.data['cloudrig_ui'] = rig.data['cloudrig_ui'] = text
 		else:
-			metarig.data.rigify_rig_ui = rig.data.rigify_rig_ui = load_script(
-				file_path=os.path.dirname(os.path.realpath(__file__)),
-				file_name="cloudrig.py",
-				rigify_rig_basename=rigify_rig_basename,  # Pass the basename here
-				datablock=metarig.data.rigify_rig_ui
-			)
+			metarig.data.rigify_rig_ui = rig.data.rigify_rig_ui = text
+
+		# Remove the per-rig copy of the script that older versions created.
+		if isinstance(old_text, bpy.types.Text) and old_text != text:
+			if 'cloudrig_script_hash' in old_text or old_text.name == f"{rigify_rig_basename}.py":
+				bpy.data.texts.remove(old_text)
 
 	# def ensure_cloudrig_ui(self, metarig, rig):
 	# 	"""Load and execute cloudrig.py rig UI script."""
@@ -924,18 +1158,64 @@ class CloudGenerator(Generator):
 
 		self.use_mirror_widgets = self.metarig.data.rigify_mirror_widgets
 
+		# Widget objects loaded during this generation, by widget name.
+		self.ensured_widgets: Dict[str, Object] = {}
+		widget_library.reindex()
+		if self.params.rigify_force_widget_update:
+			widget_library.unshare_meshes(self.widget_collection.all_objects)
+
 		# Build tables for existing widgets
 		self.old_widget_table = {}
 		self.new_widget_table = {}
 		self.widget_mirror_mesh = {}
 
+		# Find the widgets that the previous rig uses from the widget collection,
+		# so that Rigify's create_widget() re-uses them instead of creating new ones.
+		# Unlike Rigify, don't rename them, and don't delete them on Force Widget Update,
+		# since ensure_widget() already overwrites CloudRig's widgets in that case.
+		old_rig = self.metarig.data.rigify_target_rig
+		if old_rig and old_rig.pose and not self.params.rigify_force_widget_update:
+			known_widgets = {ob.name for ob in self.widget_collection.all_objects}
+			for pb in old_rig.pose.bones:
+				if pb.custom_shape and pb.custom_shape.name in known_widgets:
+					self.old_widget_table[pb.name] = pb.custom_shape
+
 		# Find meshes for mirroring
 		if self.use_mirror_widgets:
 			for bone_name, widget in self.old_widget_table.items():
 				mid_name = change_name_side(bone_name, Side.MIDDLE)
-				if bone_name != mid_name:
+				if bone_name != mid_name and widget.type == 'MESH':
 					self.widget_mirror_mesh[mid_name] = widget.data
 
+	def get_rig_type(self, rig: BaseRig) -> str:
+		meta_bone = self.metarig.pose.bones.get(rig.base_bone.replace(ORG_PREFIX, "", 1))
+		if meta_bone:
+			return meta_bone.rigify_type
+		return type(rig).__module__.split(".")[-1]
+
+	def instrument_rig_stages(self):
+		"""Wrap the stage invocation of each rig component, so that the time
+		spent in each stage is attributed to that component in self.metrics."""
+		metrics = self.metrics
+		for rig in self.rig_list:
+			def timed_invoke_stage(stage, rig=rig, invoke_stage=rig.rigify_invoke_stage, rig_type=self.get_rig_type(rig)):
+				start = time.perf_counter()
+				try:
+					return invoke_stage(stage)
+				finally:
+					metrics.add_component_time(rig.base_bone, rig_type, stage, time.perf_counter() - start)
+			rig.rigify_invoke_stage = timed_invoke_stage
+
+	def report_slowest_components(self, count=5):
+		"""Add the slowest rig components to the Generation Log."""
+		for base_bone, component in self.metrics.slowest_components(count):
+			stages = sorted(component['stages'].items(), key=lambda item: item[1], reverse=True)
+			breakdown = ", ".join([f"{stage}: {duration:.3f}s" for stage, duration in stages])
+			self.logger.log("Slow Rig Component"
+				,owner_bone	 = base_bone
+				,description = f'Rig component "{base_bone}" ({component["type"]}) took {component["total"]:.3f} seconds to generate. {breakdown}'
+			)
+
 	def invoke_load_bone_infos(self):
 		"""Bit of a hacked-in additional stage to load BoneInfos before
 		prepare_bones. 
@@ -948,14 +1228,64 @@ class CloudGenerator(Generator):
 		"""
 		for rig in self.rig_list:
 			if hasattr(rig, 'load_bone_infos'):
+				start = time.perf_counter()
 				rig.load_bone_infos()
+				self.metrics.add_component_time(rig.base_bone, self.get_rig_type(rig), 'load_bone_infos', time.perf_counter() - start)
+
+	def finish_stage(self, stage_name: str):
+		"""Attribute the time since the previous stage to a stage, and re-index
+		BoneInfos, since rig components may rename BoneInfos by assigning
+		their name directly, which the index can't notice by itself."""
+		self.metrics.tick(stage_name)
+		self.bone_infos.reindex()
+
+	def set_mode(self, mode: str):
+		"""Switch the active object's mode, unless it's already in that mode.
+		Switching between Object and Edit mode rebuilds or flushes every edit bone,
+		so the switches are counted in the generation metrics."""
+		active = self.context.view_layer.objects.active
+		if active and active.mode == mode:
+			return
+		bpy.ops.object.mode_set(mode=mode)
+		self.metrics.mode_switches += 1
+
+	@staticmethod
+	def rig_uses_stage(rig, stage: str) -> bool:
+		"""Return whether a rig or generator plugin does anything in a stage.
+		Rigify calls both the method named after the stage, and any methods
+		decorated with that stage."""
+		try:
+			cls = type(rig)
+			if cls.rigify_stage_map.get(stage):
+				return True
+			if getattr(cls, stage) is not getattr(GenerateCallbackHost, stage):
+				return True
+			return any([CloudGenerator.rig_uses_stage(sub, stage) for sub in rig.rigify_sub_objects])
+		except AttributeError:
+			# Be conservative if Rigify's stage internals are not what we expect.
+			return True
+
+	def find_armature_constrained_bones(self, parented_only=True, enabled_only=True) -> List[str]:
+		"""Return names of bones with an Armature constraint.
+		Pose bone parents aren't up to date in Edit mode, so parented_only
+		should only be used outside of it."""
+		return [pb.name for pb in self.obj.pose.bones if (pb.parent or not parented_only) and
+				any([c.type=='ARMATURE' and (c.enabled or not enabled_only) for c in pb.constraints])]
+
+	def needs_apply_pass(self) -> bool:
+		"""The apply_bones stage requires switching to Edit mode and back.
+		Only do that when a rig or plugin uses that stage, or there are bones
+		to un-parent in invoke_apply_bones()."""
+		if self.armature_constrained_bones:
+			return True
+		return any([self.rig_uses_stage(rig, 'apply_bones') for rig in self.rig_list + self.plugin_list])
 
 	def generate(self, context):
-		bpy.ops.object.mode_set(mode='OBJECT')
+		self.set_mode('OBJECT')
 
 		metarig = self.metarig
 		print("Begin Generating CloudRig from metarig: " + metarig.name)
-		t = Timer()
+		t = self.metrics
 
 		# self.collection is only used for Rigify compatibility.
 		self.collection = context.scene.collection
@@ -993,6 +1323,7 @@ class CloudGenerator(Generator):
 
 		self.defaults['rig'] = obj
 
+
 		# Create Widget Collection
 		self.ensure_widget_collection()
 
@@ -1010,13 +1341,14 @@ class CloudGenerator(Generator):
 		#------------------------------------------
 		self.instantiate_rig_tree()
 		self.cloudrig_reorder_rigs(self.rig_list)
+		self.instrument_rig_stages()
 
 		#------------------------------------------
 		self.invoke_initialize()
-		t.tick("Initialize rigs: ")
+		self.finish_stage("Initialize")
 
 		#------------------------------------------
-		bpy.ops.object.mode_set(mode='EDIT')
+		self.set_mode('EDIT')
 		self.root_bone = None
 		self.create_root_bones()
 		if self.rigify_compatible :
@@ -1024,49 +1356,51 @@ class CloudGenerator(Generator):
 
 		#------------------------------------------
 		self.invoke_load_bone_infos()
-		t.tick("Load BoneInfos: ")
+		self.finish_stage("Load BoneInfos")
 
 		#------------------------------------------
 		self.invoke_prepare_bones()
-		t.tick("Prepare bones: ")
+		self.finish_stage("Prepare Bones")
 
 		#------------------------------------------
 		self.invoke_generate_bones()
-		t.tick("Generate bones: ")
+		self.finish_stage("Generate Bones")
 
 		#------------------------------------------
 		self.invoke_parent_bones()
-		t.tick("Write Edit Data: ")
+		self.finish_stage("Write Edit Data")
 		redraw_viewport()
 
 		#------------------------------------------
-		bpy.ops.object.mode_set(mode='OBJECT')
+		self.set_mode('OBJECT')
 
 		self.ensure_bone_groups()
 		self.invoke_configure_bones()
-		t.tick("Write Pose Data: ")
+		self.finish_stage("Write Pose Data")
 		redraw_viewport()
 
 		#------------------------------------------
 		self.invoke_preapply_bones()
-		t.tick("Preapply bones: ")
+		self.finish_stage("Preapply Bones")
 
 		#------------------------------------------
-		bpy.ops.object.mode_set(mode='EDIT')
-
-		self.invoke_apply_bones()
-		t.tick("Apply bones: ")
-		redraw_viewport()
+		self.armature_constrained_bones = self.find_armature_constrained_bones()
+		if self.needs_apply_pass():
+			self.set_mode('EDIT')
+			self.invoke_apply_bones()
+			redraw_viewport()
+		self.finish_stage("Apply Bones")
 
 		#------------------------------------------
-		bpy.ops.object.mode_set(mode='OBJECT')
+		self.set_mode('OBJECT')
 		self.invoke_rig_bones()
+		self.finish_stage("Rig Bones")
 		redraw_viewport()
 
 		#------------------------------------------
 		if self.rigify_compatible:
 			self.invoke_generate_widgets()
-			t.tick("Generate widgets: ")
+			self.finish_stage("Generate Widgets")
 
 		#------------------------------------------
 		self._Generator__restore_driver_vars()
@@ -1079,13 +1413,14 @@ class CloudGenerator(Generator):
 
 		self.invoke_finalize()
 
-		t.tick("Finalize: ")
+		self.finish_stage("Finalize")
 		redraw_viewport()
 
 		#------------------------------------------
-		bpy.ops.object.mode_set(mode='OBJECT')
+		self.set_mode('OBJECT')
 
 		self._Generator__assign_widgets()
+		t.tick("Assign Widgets")
 
 		self.create_test_animation()
 
@@ -1106,17 +1441,28 @@ class CloudGenerator(Generator):
 
 		ensure_custom_panels(None, None)
 
-		t.tick("The rest: ")
+		t.tick("The Rest")
 		self.restore_rig_states()
 		self.log_minor_issues()
 		self.update_bone_set_ui_info()
-		t.tick("Cleanup & Troubleshoot: ")
-		t.total()
+		if self.params.cloudrig_parameters.profile_generation:
+			self.report_slowest_components()
+
+		# Stored next to generation_date, to skip generating when nothing changed.
+		# This is done last, since generation itself changes some of the hashed
+		# metarig settings, eg. by creating bone groups on the metarig.
+		# Generation doesn't change the hashed properties of metarig bones,
+		# so their hash can be re-used from before generation.
+		bones_hash = self.bones_hash or hash_metarig_bones(metarig)
+		obj.data['generation_hash'] = get_generation_hash(metarig, bones_hash, get_cloudrig_version())
+		t.tick("Cleanup & Troubleshoot")
+		print(f"Total: {t.total:.3f} ({t.mode_switches} mode switches)")
+		t.store(self)
 
 	def restore_rig_states(self):
 		"""Restore transforms after generation has either failed or succeeded."""
 
-		bpy.ops.object.mode_set(mode='OBJECT')
+		self.set_mode('OBJECT')
 		self.metarig.data.pose_position = 'POSE'
 		if 'loc_bkp' in self.metarig:
 			self.metarig.location = self.metarig['loc_bkp'].to_list()
@@ -1128,11 +1474,27 @@ class CloudGenerator(Generator):
 		self.obj.data.pose_position = 'POSE'
 		self.metarig.data.use_mirror_x = self.bkp_x_mirror
 
-		# Refresh drivers
-		refresh_all_drivers()
-		refresh_constraints(self.obj)
+		# Refresh drivers and constraints
+		if self.params.cloudrig_parameters.full_refresh:
+			refresh_all_drivers()
+			refresh_constraints(self.obj)
+		else:
+			self.refresh_generated_drivers()
+			# Other constraints were created during generation, which already
+			# rebuilt relations. Armature constraints need a nudge to bind to their targets.
+			refresh_constraints(self.obj, self.find_armature_constrained_bones(parented_only=False, enabled_only=False))
 		self.context.view_layer.update()
 
+	def refresh_generated_drivers(self):
+		"""Refresh the drivers of the generated rig, and of the IDs that use it,
+		eg. through driver variables or parenting."""
+		ids = {self.obj, self.obj.data}
+		ids |= bpy.data.user_map(subset={self.obj}).get(self.obj, set())
+		for id_data in ids:
+			refresh_drivers(id_data)
+			if isinstance(id_data, Object) and id_data.data:
+				refresh_drivers(id_data.data)
+
 	def log_minor_issues(self):
 		self.logger.report_unused_named_layers()
 		self.logger.report_widgets(self.widget_collection)
@@ -1141,8 +1503,11 @@ class CloudGenerator(Generator):
 		self.logger.report_unused_bone_groups()
 		# self.logger.report_actions()
 
-def refresh_constraints(rig: bpy.types.Object):
-	for pb in rig.pose.bones:
+def refresh_constraints(rig: bpy.types.Object, bone_names: List[str] = None):
+	pose_bones = rig.pose.bones
+	if bone_names is not None:
+		pose_bones = [pose_bones[name] for name in bone_names if name in pose_bones]
+	for pb in pose_bones:
 		for c in pb.constraints:
 			if hasattr(c, 'target'):
 				c.target = c.target
@@ -1150,6 +1515,32 @@ def refresh_constraints(rig: bpy.types.Object):
 				for t in c.targets:
 					t.target = t.target
 
+def transfer_selection_sets(old_rig: Object, new_rig: Object) -> Dict[str, List[str]]:
+	"""Copy the selection sets of the Selection Sets add-on from one rig to another.
+	Bones that don't exist on the new rig are skipped.
+	Return the names of skipped bones, per selection set name."""
+	new_bones = new_rig.data.bones
+	dropped_bones = {}
+	for old_set in old_rig.selection_sets:
+		new_set = new_rig.selection_sets.get(old_set.name)
+		if new_set:
+			new_set.bone_ids.clear()
+		else:
+			new_set = new_rig.selection_sets.add()
+			new_set.name = old_set.name
+		new_set.is_selected = old_set.is_selected
+
+		for bone_id in old_set.bone_ids:
+			if bone_id.name not in new_bones:
+				dropped_bones.setdefault(old_set.name, []).append(bone_id.name)
+				continue
+			new_set.bone_ids.add().name = bone_id.name
+
+	if 0 <= old_rig.active_selection_set < len(old_rig.selection_sets):
+		active_set = old_rig.selection_sets[old_rig.active_selection_set]
+		new_rig.active_selection_set = new_rig.selection_sets.find(active_set.name)
+	return dropped_bones
+
 def is_single_cloud_metarig(context):
 	"""If there is only one CloudRig metarig in the scene, return it."""
 	ret = None
@@ -1174,6 +1565,12 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 		,default = True
 		,description = "After successfully generating a single rig, hide the metarig, unhide the generated rig, enter the same mode as the current mode, and match bone selection states where possible"
 	)
+	force: BoolProperty(
+		name = "Force"
+		,default = False
+		,options = {'SKIP_SAVE'}
+		,description = "Generate even if nothing that affects the generated rig changed since the last generation"
+	)
 
 	@classmethod
 	def poll(cls, context):
@@ -1196,6 +1593,14 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 			self.report({'ERROR'}, "Could not find metarig.")
 			return {'CANCELLED'}
 
+		# Hashing the metarig's bones is the costly part of the generation hash,
+		# so it's done once here, and re-used by the generator.
+		# In Edit mode, the bones don't reflect the latest changes yet.
+		bones_hash = hash_metarig_bones(metarig) if metarig.mode != 'EDIT' else ""
+		if not self.force and is_generation_up_to_date(metarig, bones_hash):
+			self.report({'INFO'}, "Nothing changed since the last generation. Use Force to generate anyway.")
+			return {'FINISHED'}
+
 		### Save state so it can be restored for convenience
 		state_mode = 'OBJECT'
 		state_active_bone = context.active_pose_bone.name if context.active_pose_bone else ""
@@ -1212,7 +1617,7 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 		context.view_layer.objects.active = metarig
 
 		# Generate, without halting execution on failure
-		rig = self.generate_rig(context, metarig)
+		rig = self.generate_rig(context, metarig, bones_hash)
 
 		if not rig:
 			return {'FINISHED'}
@@ -1237,7 +1642,7 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 
 		self.report({'ERROR'}, '\n'.join(message))
 
-	def generate_rig(self, context, metarig):
+	def generate_rig(self, context, metarig, bones_hash=""):
 		"""Generates a rig from a metarig."""
 		meta_visible = EnsureVisible(metarig)
 		target_rig = metarig.data.rigify_target_rig
@@ -1245,7 +1650,7 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 		if target_rig:
 			rig_visible = EnsureVisible(target_rig)
 
-		generator = CloudGenerator(context, metarig)
+		generator = CloudGenerator(context, metarig, bones_hash)
 		try:
 			generator.generate(context)
 		except Exception as exc:
@@ -1307,10 +1712,41 @@ class CLOUDRIG_OT_generate(bpy.types.Operator):
 
 			bone.hide = False
 
+class CLOUDRIG_OT_export_generation_metrics(bpy.types.Operator, ExportHelper):
+	"""Export the stage timings of the last generation of this rig to a JSON file"""
+
+	bl_idname = "pose.cloudrig_export_generation_metrics"
+	bl_label = "Export Generation Metrics"
+	bl_options = {'REGISTER'}
+
+	filename_ext = ".json"
+	filter_glob: StringProperty(default="*.json", options={'HIDDEN'})
+
+	@staticmethod
+	def get_rig(context):
+		rig = is_active_cloudrig(context)
+		if not rig:
+			metarig = is_active_cloud_metarig(context)
+			rig = metarig.data.rigify_target_rig if metarig else None
+		return rig
+
+	@classmethod
+	def poll(cls, context):
+		rig = cls.get_rig(context)
+		return rig is not None and 'generation_metrics' in rig.data
+
+	def execute(self, context):
+		rig = self.get_rig(context)
+		with open(self.filepath, 'w') as f:
+			f.write(generation_metrics_to_json(rig))
+		self.report({'INFO'}, f'Exported generation metrics of "{rig.name}".')
+		return {'FINISHED'}
+
 registry = [
 	CloudRigProperties,
 
 	CLOUDRIG_OT_generate,
+	CLOUDRIG_OT_export_generation_metrics,
 ]
 
 def register():
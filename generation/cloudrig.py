@@ -1,13 +1,13 @@
 """
 This file is executed and loaded into a self-registering text datablock when a
-rig is generated with the CloudRig feature set.
+rig is generated with the CloudRig feature set. The text datablock is shared by
+all CloudRig rigs in the file, each rig only stores the name of its sidebar tab.
 It's responsible for drawing rig UI and operators such as IK/FK snapping and
 keyframe baking.
 
 Only one instance of this script is required to run in a scene, regardless of how
 many CloudRig characters are in the scene.
 """
-import os
 from typing import List, Dict, Tuple
 import bpy, traceback, json, collections, re
 from bpy.props import (
@@ -109,10 +109,21 @@ def find_action(action):
 	else:
 		return None
 	
-def get_rig_name():
-    """Retrieve the Blender text datablock name dynamically or use a default."""
-    datablock_name = globals().get("__file_name__", "fallback_script.py")
-    return "RIG-" + os.path.splitext(os.path.basename(datablock_name))[0]
+# Sidebar tab of rigs that were generated before the tab name was stored on the rig.
+DEFAULT_CATEGORY = "CloudRig"
+
+def get_rig_name(rig=None):
+	"""Return the name of the sidebar tab of a rig, which is stored on the rig
+	during generation. If no rig is given, the active rig is used."""
+	if not rig:
+		try:
+			rig = is_active_cloudrig(bpy.context)
+		except AttributeError:
+			# The context is restricted while scripts are registered on file load.
+			rig = None
+	if rig and 'cloudrig_ui_category' in rig.data:
+		return rig.data['cloudrig_ui_category']
+	return DEFAULT_CATEGORY
 
 
 TRANSFORM_PROPS_LOCATION = frozenset(['location'])
@@ -1496,10 +1507,6 @@ class CLOUDRIG_PT_character(CLOUDRIG_PT_base):
 			props_done = []
 
 			def add_prop(layout, prop_owner, prop_id):
-				def get_rig_name():
-					"""Retrieve the Blender text datablock name dynamically or use a default."""
-					datablock_name = globals().get("__file_name__", "fallback_script.py")
-					return os.path.splitext(os.path.basename(datablock_name))[0]
 				row = layout.row()
 				if prop_id in props_done: return
 
@@ -1511,7 +1518,7 @@ class CLOUDRIG_PT_character(CLOUDRIG_PT_base):
 					if 'op_'+prop_id in prop_owner or prop_id=='Quality':
 						# HACK: Hard-code behaviour for a property named "Quality", so I don't have to add it on every character manually on Sprite Fright. This needs a more elegant design...
 						if prop_id=='Quality':
-							op_info = {'bl_idname': 'object.cloudrig_copy_property', 'bl_category': get_rig_name(), 'prop_bone':prop_owner.name, 'prop_id':'Quality', 'icon':'WORLD'}
+							op_info = {'bl_idname': 'object.cloudrig_copy_property', 'bl_category': get_rig_name(rig), 'prop_bone':prop_owner.name, 'prop_id':'Quality', 'icon':'WORLD'}
 						else:
 							op_info = prop_owner["op_"+prop_id]
 						if type(op_info)==str:
@@ -1635,57 +1642,63 @@ custom_panels = []
 # 	custom_panels.append(new_panel)
 
 def ensure_custom_panel(name, parent_id="CLOUDRIG_PT_settings"):
-    import os
-    import re
-
-    def get_rig_name():
-        """Retrieve the Blender text datablock name dynamically or use a default."""
-        datablock_name = globals().get("__file_name__", "fallback_script.py")
-        rig_name = os.path.splitext(os.path.basename(datablock_name))[0]
-        return 'RIG' + rig_name
-
-    def update_category(panel_class, rig_name):
-        """Dynamically update the category of a registered panel."""
-        panel_class.bl_category = rig_name
-
-    # Make sure name is alphanumeric
-    sane_name = re.sub(r'\W+', '', name)
-    full_name = "CLOUDRIG_PT_custom_" + sane_name.lower().replace(" ", "")
-
-    # Check if panel already exists and unregister if necessary
-    if hasattr(bpy.types, full_name):
-        bpy.utils.unregister_class(getattr(bpy.types, full_name))
-
-    if not hasattr(bpy.types, parent_id):
-        parent_id = "CLOUDRIG_PT_settings"
-
-    # Compute rig name and dynamically create a new class
-    rig_name = get_rig_name()
-    new_panel = type(
-        full_name,
-        (CLOUDRIG_PT_custom_panel,),  # Base classes as a tuple
-        {
-            'bl_idname': full_name,
-            'bl_label': name,
-            'bl_parent_id': parent_id,
-            'bl_category': '',  # Placeholder
-        }
-    )
-
-    bpy.utils.register_class(new_panel)
-    update_category(new_panel, rig_name)
-
-    # Save a reference so it can be un-registered
-    global custom_panels
-    custom_panels.append(new_panel)
+	# Make sure name is alphanumeric
+	sane_name = re.sub(r'\W+', '', name)
+	full_name = "CLOUDRIG_PT_custom_"+sane_name.lower().replace(" ", "")
+
+	if not hasattr(bpy.types, parent_id):
+		parent_id  = "CLOUDRIG_PT_settings"
+	category = get_rig_name()
+
+	existing = getattr(bpy.types, full_name, None)
+	if existing:
+		if existing.bl_parent_id == parent_id and existing.bl_category == category:
+			return
+		bpy.utils.unregister_class(existing)
+		if existing in custom_panels:
+			custom_panels.remove(existing)
+
+	# Dynamically create a new class, so it can be registered as a sub-panel.
+	new_panel = type(
+		full_name
+		,(CLOUDRIG_PT_custom_panel,)
+		,{'bl_idname': full_name, 'bl_label': name, 'bl_parent_id': parent_id, 'bl_category': category}
+	)
 
+	bpy.utils.register_class(new_panel)
 
+	# Save a reference so it can be un-registered.
+	custom_panels.append(new_panel)
 
+def set_panel_category(category):
+	"""Move all panels of this script to a different sidebar tab.
+	bl_category is only read when a panel is registered, so the panels are
+	re-registered: Unregistered children first, and registered parents first."""
+	if not CLOUDRIG_PT_settings.is_registered:
+		# This instance of the script isn't the registered one.
+		return
+	panels = [cls for cls in classes if issubclass(cls, bpy.types.Panel)] + custom_panels
+	if all([cls.bl_category == category for cls in panels]):
+		return
+	for cls in reversed(panels):
+		if cls.is_registered:
+			bpy.utils.unregister_class(cls)
+	for cls in panels:
+		cls.bl_category = category
+		bpy.utils.register_class(cls)
 
 def ensure_custom_panels(_dummy1, _dummy2):
+	registered = bpy.app.driver_namespace.get(REGISTRY_KEY)
+	if registered and registered['unregister'] is not unregister:
+		# Let the registered instance of this script manage its own panels.
+		registered['ensure_custom_panels'](_dummy1, _dummy2)
+		return
+
 	rig = is_active_cloudrig(bpy.context)
 	if not rig:
 		return
+	# The panels are shared by all rigs, and show in the active rig's sidebar tab.
+	set_panel_category(get_rig_name(rig))
 	if 'ui_data' not in rig.data:
 		return
 	custom_panels = rig.data['ui_data'].to_dict()
@@ -1972,44 +1985,76 @@ classes = (
 # 	bpy.app.handlers.load_post.remove(ensure_custom_panels)
 # 	bpy.app.handlers.depsgraph_update_post.remove(ensure_custom_panels)
 
-def register():
-    from bpy.utils import register_class
-
-    # Update `bl_category` for all panels dynamically based on the rigify_rig_basename
-    # rigify_rig_basename = bpy.context.scene.get("rigify_rig_basename", "CloudRig")
-    for cls in classes:
-        if hasattr(cls, "bl_category"):  # Update bl_category if the class has it
-            cls.bl_category = get_rig_name()
+# Key in bpy.app.driver_namespace of the currently registered instance of this script.
+REGISTRY_KEY = "cloudrig_ui"
 
-    # Register all classes
-    for cls in classes:
-        if cls.__name__ == 'CLOUDRIG_PT_settings' and hasattr(bpy.types, 'CLOUDRIG_PT_settings'):
-            # Skip re-registering settings panel to avoid duplication issues
-            cls.bl_category = get_rig_name()
-        register_class(cls)
+def register():
+	"""Register the rig UI. Only one instance of this script is registered at a time,
+	even if it's executed by several rigs or files: The registered instance
+	is tracked in the driver namespace, which lasts for the whole session."""
+	from bpy.utils import register_class, unregister_class
+
+	# Set by load_script() in cloud_generator.py. Empty when executed from the Text Editor.
+	version = globals().get("__cloudrig_ui_version__", "")
+	registered = bpy.app.driver_namespace.get(REGISTRY_KEY)
+	if registered:
+		if version and registered['version'] == version:
+			# This exact script is already registered.
+			return
+		registered['unregister']()
+
+	# Classes registered by instances of this script that weren't tracked.
+	for name in dir(bpy.types):
+		if name.startswith("CLOUDRIG_PT_custom_"):
+			unregister_class(getattr(bpy.types, name))
+	for cls in reversed(classes):
+		existing = getattr(bpy.types, cls.__name__, None)
+		if existing:
+			unregister_class(existing)
+
+	category = get_rig_name()
+	for cls in classes:
+		if hasattr(cls, 'bl_category'):
+			cls.bl_category = category
+		register_class(cls)
+
+	# Store outfit properties in Object because it can be accessed on Proxies.
+	bpy.types.Object.cloud_rig = PointerProperty(type=CloudRig_Properties)
+
+	for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.depsgraph_update_post):
+		for func in [func for func in handlers if func.__name__ == ensure_custom_panels.__name__]:
+			handlers.remove(func)
+		handlers.append(ensure_custom_panels)
+
+	bpy.app.driver_namespace[REGISTRY_KEY] = {
+		'version' : version
+		,'unregister' : unregister
+		,'ensure_custom_panels' : ensure_custom_panels
+	}
+	ensure_custom_panels(None, None)
 
-    # Register properties and handlers
-    ensure_custom_panels(None, None)
-    bpy.types.Object.cloud_rig = PointerProperty(type=CloudRig_Properties)
-    bpy.app.handlers.load_post.append(ensure_custom_panels)
-    bpy.app.handlers.depsgraph_update_post.append(ensure_custom_panels)
+def unregister():
+	from bpy.utils import unregister_class
 
+	for cls in reversed(custom_panels):
+		if cls.is_registered:
+			unregister_class(cls)
+	custom_panels.clear()
 
-def unregister():
-    from bpy.utils import unregister_class
+	if hasattr(bpy.types.Object, 'cloud_rig'):
+		del bpy.types.Object.cloud_rig
 
-    # Unregister all classes
-    for cls in classes:
-        unregister_class(cls)
+	for cls in reversed(classes):
+		if cls.is_registered:
+			unregister_class(cls)
 
-    global custom_panels
-    for cls in custom_panels:
-        unregister_class(cls)
+	for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.depsgraph_update_post):
+		if ensure_custom_panels in handlers:
+			handlers.remove(ensure_custom_panels)
 
-    # Remove properties and handlers
-    del bpy.types.Object.cloud_rig
-    bpy.app.handlers.load_post.remove(ensure_custom_panels)
-    bpy.app.handlers.depsgraph_update_post.remove(ensure_custom_panels)
+	registered = bpy.app.driver_namespace.get(REGISTRY_KEY)
+	if registered and registered['unregister'] is unregister:
+		del bpy.app.driver_namespace[REGISTRY_KEY]
 
 if __name__ in ['__main__', 'builtins']:
 	# __name__ is __main__ when the script is executed in the text editor.
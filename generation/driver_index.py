@@ -0,0 +1,39 @@
+"""
+Index the drivers of an ID by the pose bone they belong to, in a single pass
+over its drivers.
+"""
+
+from typing import Dict, List, Tuple, Optional
+import re
+
+from bpy.types import ID
+
+# (data_path, array_index) pair that identifies a driver.
+DriverKey = Tuple[str, int]
+
+QUOTED = r'"((?:[^"\\]|\\.)*)"'
+RE_BONE = re.compile(r'^pose\.bones\[' + QUOTED + r'\]')
+
+def unescape(name: str) -> str:
+	"""Reverse of bpy.utils.escape_identifier()."""
+	return re.sub(r'\\(.)', r'\1', name)
+
+def parse_bone_name(data_path: str) -> str:
+	"""Return the name of the pose bone a driver's data path belongs to,
+	or "" if it doesn't belong to a pose bone."""
+	match = RE_BONE.match(data_path)
+	return unescape(match.group(1)) if match else ""
+
+def index_bone_drivers(id_data: Optional[ID] = None) -> Dict[str, List[DriverKey]]:
+	"""Map bone names to the drivers of anything that belongs to that pose bone,
+	eg. its transforms, constraints and custom properties.
+	The result is empty if the ID has no drivers."""
+	bone_drivers: Dict[str, List[DriverKey]] = {}
+	anim_data = getattr(id_data, 'animation_data', None)
+	if not anim_data:
+		return bone_drivers
+	for fc in anim_data.drivers:
+		bone_name = parse_bone_name(fc.data_path)
+		if bone_name:
+			bone_drivers.setdefault(bone_name, []).append((fc.data_path, fc.array_index))
+	return bone_drivers
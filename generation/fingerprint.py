@@ -0,0 +1,130 @@
+"""
+Content hashes of metarig data, used to find out whether a metarig changed
+since the rig was last generated.
+"""
+
+from typing import Dict, Tuple
+import hashlib
+
+import bpy
+from bpy.types import Object
+
+# Floats are rounded so that imprecision doesn't register as a change.
+FLOAT_PRECISION = 5
+
+BONE_PROPERTIES = (
+	'head_local', 'tail_local', 'matrix_local', 'use_connect', 'use_deform',
+	'bbone_segments', 'bbone_x', 'bbone_z', 'layers', 'inherit_scale',
+	'use_inherit_rotation', 'use_local_location', 'envelope_distance'
+)
+# Rig parameters that only affect the UI, and are written by generation itself.
+IGNORED_RIGIFY_PARAMETERS = {'CR_active_bone_set_index'}
+
+POSE_BONE_PROPERTIES = (
+	'rotation_mode', 'lock_location', 'lock_rotation', 'lock_rotation_w', 'lock_scale',
+	'custom_shape_scale_xyz', 'use_custom_shape_bone_size'
+)
+
+def to_hashable(value):
+	"""Convert a property value to something with a stable repr()."""
+	if isinstance(value, float):
+		return round(value, FLOAT_PRECISION)
+	if isinstance(value, (str, int, bool)) or value is None:
+		return value
+	if isinstance(value, bpy.types.ID):
+		return ('ID', type(value).__name__, value.name)
+	if hasattr(value, 'to_dict'):
+		value = value.to_dict()
+	if isinstance(value, dict):
+		return tuple((key, to_hashable(value[key])) for key in sorted(value.keys()))
+	if hasattr(value, 'to_list'):
+		value = value.to_list()
+	if hasattr(value, '__len__') and not isinstance(value, bpy.types.bpy_struct):
+		return tuple(to_hashable(v) for v in value)
+	return repr(value)
+
+# Hashed property names of each RNA struct type, eg. of each constraint type.
+struct_properties: Dict[str, Tuple[Tuple[str, bool], ...]] = {}
+
+def get_struct_properties(struct) -> Tuple[Tuple[str, bool], ...]:
+	"""Return the (identifier, is_pointer) pairs of the properties of a struct
+	that are hashed. Looked up once per struct type rather than per struct."""
+	bl_rna = struct.bl_rna
+	props = struct_properties.get(bl_rna.identifier)
+	if props is None:
+		props = struct_properties[bl_rna.identifier] = tuple(
+			(prop.identifier, prop.type == 'POINTER')
+			for prop in bl_rna.properties
+			if prop.identifier != 'rna_type' and prop.type != 'COLLECTION'
+		)
+	return props
+
+def rna_struct_to_hashable(struct) -> tuple:
+	"""Convert the non-pointer RNA properties of a struct, eg. a constraint, to a tuple."""
+	values = []
+	for identifier, is_pointer in get_struct_properties(struct):
+		value = getattr(struct, identifier)
+		if is_pointer and not isinstance(value, bpy.types.ID):
+			continue
+		values.append((identifier, to_hashable(value)))
+	return tuple(values)
+
+def bone_to_hashable(metarig: Object, bone_name: str) -> tuple:
+	"""Collect everything about a metarig bone that affects generation."""
+	bone = metarig.data.bones[bone_name]
+	pose_bone = metarig.pose.bones[bone_name]
+	return (
+		bone_name
+		,bone.parent.name if bone.parent else ""
+		,tuple(to_hashable(getattr(bone, prop)) for prop in BONE_PROPERTIES)
+		,tuple(to_hashable(getattr(pose_bone, prop)) for prop in POSE_BONE_PROPERTIES)
+		,pose_bone.rigify_type
+		,to_hashable({key : value for key, value in pose_bone.rigify_parameters.items() if key not in IGNORED_RIGIFY_PARAMETERS})
+		,pose_bone.custom_shape.name if pose_bone.custom_shape else ""
+		,pose_bone.bone_group.name if pose_bone.bone_group else ""
+		,tuple(rna_struct_to_hashable(c) for c in pose_bone.constraints)
+		,to_hashable({key : value for key, value in pose_bone.items() if key not in {'rigify_type', 'rigify_parameters'}})
+	)
+
+def hash_string(string: str) -> str:
+	return hashlib.sha1(string.encode()).hexdigest()
+
+def hash_metarig_bones(metarig: Object) -> str:
+	"""Hash everything about the bones of a metarig that affects generation."""
+	return hash_string(repr([bone_to_hashable(metarig, bone.name) for bone in metarig.data.bones]))
+
+# Properties of the metarig's Armature datablock that affect generation.
+GENERATOR_PROPERTIES = (
+	'rigify_rig_basename', 'rigify_colors_lock', 'rigify_mirror_widgets', 'rigify_widgets_collection',
+	'layers', 'layers_protected', 'show_names', 'show_axes'
+)
+# CloudRig generator parameters that don't affect the generated rig.
+IGNORED_CLOUDRIG_PARAMETERS = {
+	'advanced_mode', 'show_layers_preview_hidden', 'bone_set_use_grid_layout', 'active_log_index',
+	'full_refresh', 'profile_generation'
+}
+
+def generator_settings_to_hashable(metarig: Object) -> tuple:
+	"""Collect the generator settings of a metarig that affect generation."""
+	data = metarig.data
+	cloudrig = data.cloudrig_parameters
+	scripts = [data.rigify_finalize_script, cloudrig.custom_script]
+	return (
+		tuple((prop, to_hashable(getattr(data, prop, None))) for prop in GENERATOR_PROPERTIES)
+		,tuple(value for value in rna_struct_to_hashable(cloudrig) if value[0] not in IGNORED_CLOUDRIG_PARAMETERS)
+		,rna_struct_to_hashable(data.rigify_selection_colors)
+		,tuple(rna_struct_to_hashable(layer) for layer in data.rigify_layers)
+		,tuple((bg.name, bg.color_set, to_hashable(bg.colors.normal), to_hashable(bg.colors.select), to_hashable(bg.colors.active))
+			for bg in metarig.pose.bone_groups)
+		,tuple(text.as_string() if text else "" for text in scripts)
+		,metarig.show_in_front
+	)
+
+def get_generation_hash(metarig: Object, bones_hash: str, version: str) -> str:
+	"""Return a hash of everything that affects the result of generating a metarig,
+	given the hash of its bones from hash_metarig_bones()."""
+	return hash_string(repr((
+		version
+		,bones_hash
+		,generator_settings_to_hashable(metarig)
+	)))
@@ -0,0 +1,199 @@
+"""
+Determine the order in which rig components are executed.
+
+Rigify executes rig components in hierarchical order, but some CloudRig rig
+types have to be executed before or after certain other rig components.
+Instead of moving rigs around in the rig list, each rig type declares its
+ordering rules, and the rig list is sorted topologically according to them.
+
+Rules are looked up in the rig class' `cloudrig_order_rules` attribute if it
+has one, or otherwise in DEFAULT_RIG_ORDER_RULES by class name. A rule is a
+dictionary with any of these keys:
+	'after_all'    : Class names of rigs that must be executed before this one.
+	                 "*" stands for all rigs of a different type than this one.
+	'before_all'   : Class names of rigs that must be executed after this one.
+	'after_params' : Names of rig parameters that hold the name of a rig's base bone,
+	                 without the ORG- prefix. Those rigs must be executed before this one.
+"""
+
+from typing import Dict, List, Set, Tuple, Callable, Optional
+import heapq
+
+DEFAULT_RIG_ORDER_RULES: Dict[str, dict] = {
+	# Tweaks affect bones created by other rigs, so they come last.
+	'CloudTweakRig' : {
+		'after_all' : ('*',)
+	}
+	# Face chains look for the bones of chain anchors.
+	,'CloudChainAnchorRig' : {
+		'before_all' : ('CloudFaceChainRig',)
+	}
+	,'CloudJawRig' : {
+		'after_params' : (
+			'CR_jaw_lower_face_bone', 'CR_jaw_squash_bone', 'CR_jaw_chin_bone', 'CR_jaw_mouth_bone',
+			'CR_jaw_teeth_follow', 'CR_jaw_teeth_upper_bone', 'CR_jaw_teeth_lower_bone'
+		)
+	}
+}
+
+def get_order_rules(rig) -> List[Tuple[str, dict]]:
+	"""Return the ordering rules that apply to a rig, along with the name of
+	the class that declared them. Rules of parent classes also apply."""
+	rules = []
+	for cls in type(rig).__mro__:
+		rule = cls.__dict__.get('cloudrig_order_rules', DEFAULT_RIG_ORDER_RULES.get(cls.__name__))
+		if rule:
+			rules.append((cls.__name__, rule))
+	return rules
+
+def get_class_names(rig) -> Set[str]:
+	return {cls.__name__ for cls in type(rig).__mro__}
+
+class RigOrderCycleError(Exception):
+	def __init__(self, cycles: List[list]):
+		# Each cycle is a list of rigs whose ordering rules contradict each other.
+		self.cycles = cycles
+		self.rigs = [rig for cycle in cycles for rig in cycle]
+		super().__init__("Rig order rules form a cycle between: " + "; ".join(
+			[", ".join([rig.base_bone for rig in cycle]) for cycle in cycles]
+		))
+
+class RigScheduler:
+	"""Sort rigs according to their ordering rules. The rigs keep their original
+	order as much as possible: a rig is only moved when a rule requires it,
+	and rigs that must come earlier are moved up right in front of the rig
+	that needs them, rather than the other way around."""
+
+	def __init__(self, rig_list: list, get_rig_by_name: Callable[[str], Optional[object]]):
+		self.rig_list = rig_list
+		self.index = {rig : i for i, rig in enumerate(rig_list)}
+		# Map each rig to the rigs that must be executed after it.
+		self.successors: Dict[object, Set[object]] = {rig : set() for rig in rig_list}
+		self.build_graph(get_rig_by_name)
+		# Map each rig to the rigs that must be executed before it.
+		self.predecessors: Dict[object, List[object]] = {rig : [] for rig in rig_list}
+		for rig, successors in self.successors.items():
+			for successor in successors:
+				self.predecessors[successor].append(rig)
+
+	def add_edge(self, before, after):
+		if before is not after and before in self.index and after in self.index:
+			self.successors[before].add(after)
+
+	def build_graph(self, get_rig_by_name):
+		class_names = {rig : get_class_names(rig) for rig in self.rig_list}
+		rigs_by_class: Dict[str, List[object]] = {}
+		for rig in self.rig_list:
+			for class_name in class_names[rig]:
+				rigs_by_class.setdefault(class_name, []).append(rig)
+
+		for rig in self.rig_list:
+			for owner_class, rule in get_order_rules(rig):
+				for class_name in rule.get('after_all', ()):
+					if class_name == "*":
+						others = [r for r in self.rig_list if owner_class not in class_names[r]]
+					else:
+						others = rigs_by_class.get(class_name, [])
+					for other in others:
+						self.add_edge(other, rig)
+				for class_name in rule.get('before_all', ()):
+					for other in rigs_by_class.get(class_name, []):
+						self.add_edge(rig, other)
+				for param_name in rule.get('after_params', ()):
+					bone_name = getattr(rig.params, param_name, "")
+					if bone_name:
+						self.add_edge(get_rig_by_name(bone_name), rig)
+
+	def sort(self) -> list:
+		"""Return the rigs in execution order, or raise RigOrderCycleError.
+
+		This is Kahn's algorithm run backwards from the last rig: among the
+		rigs that nothing else has to come after anymore, the one that was
+		originally last is placed next, so a rig is only pulled earlier
+		when a rule demands it."""
+		remaining_successors = {rig : len(successors) for rig, successors in self.successors.items()}
+
+		heap = [-self.index[rig] for rig, count in remaining_successors.items() if count == 0]
+		heapq.heapify(heap)
+		reversed_order = []
+		while heap:
+			rig = self.rig_list[-heapq.heappop(heap)]
+			reversed_order.append(rig)
+			for predecessor in self.predecessors[rig]:
+				remaining_successors[predecessor] -= 1
+				if remaining_successors[predecessor] == 0:
+					heapq.heappush(heap, -self.index[predecessor])
+
+		if len(reversed_order) != len(self.rig_list):
+			remaining = [rig for rig in self.rig_list if remaining_successors[rig] > 0]
+			raise RigOrderCycleError(self.find_cycles(remaining))
+
+		return reversed_order[::-1]
+
+	def find_cycles(self, rigs: list) -> List[list]:
+		"""Return the groups of rigs that form cycles, ie. the strongly connected
+		components of the graph with more than one rig, using Tarjan's algorithm.
+		Rigs that merely come before or after a cycle aren't part of any."""
+		rigs_set = set(rigs)
+		index: Dict[object, int] = {}
+		lowlink: Dict[object, int] = {}
+		stack: List[object] = []
+		on_stack: Set[object] = set()
+		cycles: List[list] = []
+
+		for root in rigs:
+			if root in index:
+				continue
+			# Iterative depth-first search, as (rig, iterator over its successors).
+			index[root] = lowlink[root] = len(index)
+			stack.append(root)
+			on_stack.add(root)
+			work = [(root, iter(self.successors[root]))]
+			while work:
+				rig, successors = work[-1]
+				for successor in successors:
+					if successor not in rigs_set:
+						continue
+					if successor not in index:
+						index[successor] = lowlink[successor] = len(index)
+						stack.append(successor)
+						on_stack.add(successor)
+						work.append((successor, iter(self.successors[successor])))
+						break
+					if successor in on_stack:
+						lowlink[rig] = min(lowlink[rig], index[successor])
+				else:
+					work.pop()
+					if work:
+						parent = work[-1][0]
+						lowlink[parent] = min(lowlink[parent], lowlink[rig])
+					if lowlink[rig] == index[rig]:
+						component = []
+						while True:
+							member = stack.pop()
+							on_stack.discard(member)
+							component.append(member)
+							if member is rig:
+								break
+						if len(component) > 1:
+							cycles.append(sorted(component, key=lambda r: self.index[r]))
+		return cycles
+
+	def get_groups(self, order: list) -> List[list]:
+		"""Split an execution order into groups of rigs that don't depend on each
+		other, neither through ordering rules nor through the rig hierarchy.
+		The rigs within a group could be executed in any order."""
+		position = {rig : i for i, rig in enumerate(order)}
+		level: Dict[object, int] = {}
+		groups: List[list] = []
+		for rig in order:
+			dependencies = list(self.predecessors[rig])
+			parent = getattr(rig, 'rigify_parent', None)
+			if parent in position and position[parent] < position[rig]:
+				dependencies.append(parent)
+			rig_level = max([level[dep] + 1 for dep in dependencies if dep in level], default=0)
+			level[rig] = rig_level
+			if rig_level == len(groups):
+				groups.append([])
+			groups[rig_level].append(rig)
+		return groups
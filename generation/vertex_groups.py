@@ -0,0 +1,39 @@
+"""
+Count vertex group memberships of meshes in bulk.
+
+Looping over mesh.vertices and each vertex's groups goes through RNA for every
+single membership. There is no bulk API for deform weights like foreach_get(),
+so the weights are read from a BMesh deform layer instead, which still loops
+over vertices in Python, but with one call per vertex rather than several per
+membership. The weights are then counted per vertex group with numpy.
+"""
+
+from typing import Dict
+from itertools import chain
+
+import bmesh
+import numpy as np
+from bpy.types import Object
+
+def count_vertex_group_weights(ob: Object, threshold=0.1) -> Dict[str, int]:
+	"""Return the number of vertices in each vertex group of a mesh object
+	with a weight above the threshold."""
+	if not ob.vertex_groups:
+		return {}
+
+	bm = bmesh.new()
+	bm.from_mesh(ob.data)
+	deform_layer = bm.verts.layers.deform.active
+	if not deform_layer:
+		bm.free()
+		return {vg.name : 0 for vg in ob.vertex_groups}
+	# (group index, weight) pairs of every vertex.
+	memberships = [v[deform_layer].items() for v in bm.verts]
+	bm.free()
+
+	pairs = np.fromiter(chain.from_iterable(chain.from_iterable(memberships)), dtype=np.float64).reshape(-1, 2)
+	group_indices = pairs[:, 0].astype(np.int64)
+	weights = pairs[:, 1]
+
+	counts = np.bincount(group_indices[weights > threshold], minlength=len(ob.vertex_groups))
+	return {vg.name : int(counts[vg.index]) for vg in ob.vertex_groups}
@@ -0,0 +1,92 @@
+"""
+Share widget meshes with identical geometry between widget objects.
+
+Each rig has its own widget objects, but the same widget shape is often needed
+by many rigs in a file. Widget meshes are indexed by a hash of their geometry,
+which is also stored on the mesh, so that every widget object with the same
+shape can use the same mesh datablock.
+"""
+
+from typing import Dict, Optional
+import hashlib
+
+import bpy
+import numpy as np
+from bpy.types import Mesh, Object
+
+# Custom property of widget meshes that stores the hash of their geometry.
+HASH_PROP = 'widget_hash'
+
+def hash_mesh_geometry(mesh: Mesh) -> str:
+	"""Hash the vertex positions, edges and faces of a mesh."""
+	co = np.zeros(len(mesh.vertices) * 3, dtype=np.float32)
+	mesh.vertices.foreach_get('co', co)
+	edges = np.zeros(len(mesh.edges) * 2, dtype=np.int32)
+	mesh.edges.foreach_get('vertices', edges)
+	loops = np.zeros(len(mesh.loops), dtype=np.int32)
+	mesh.loops.foreach_get('vertex_index', loops)
+	face_sizes = np.zeros(len(mesh.polygons), dtype=np.int32)
+	mesh.polygons.foreach_get('loop_total', face_sizes)
+
+	geometry_hash = hashlib.sha1()
+	# Round positions, so that imprecision doesn't prevent sharing.
+	for array in (np.round(co, 5), edges, loops, face_sizes):
+		geometry_hash.update(array.tobytes())
+	return geometry_hash.hexdigest()
+
+class WidgetLibrary:
+	"""Index of widget meshes by geometry hash, kept for the whole session."""
+
+	def __init__(self):
+		# Mesh name by geometry hash.
+		self.meshes: Dict[str, str] = {}
+
+	def reindex(self):
+		"""Index the widget meshes of the current file, since a different file
+		may have been loaded since the last generation.
+		Meshes that were edited since they were hashed are dropped from the
+		library, so that the edit doesn't spread to other widgets of their
+		original shape. Widget meshes are tiny, so re-hashing them is cheap."""
+		self.meshes = {}
+		for mesh in bpy.data.meshes:
+			stored_hash = mesh.get(HASH_PROP)
+			if not stored_hash or mesh.library:
+				continue
+			if hash_mesh_geometry(mesh) != stored_hash:
+				del mesh[HASH_PROP]
+				continue
+			self.meshes.setdefault(stored_hash, mesh.name)
+
+	def get_mesh(self, geometry_hash: str) -> Optional[Mesh]:
+		mesh = bpy.data.meshes.get(self.meshes.get(geometry_hash, ""))
+		if mesh and mesh.get(HASH_PROP) == geometry_hash:
+			return mesh
+
+	def share_mesh(self, widget: Object) -> Mesh:
+		"""Make the widget object use the library's mesh with the same geometry,
+		or add the widget's mesh to the library if there is none yet.
+		The widget's previous mesh is removed if nothing else uses it."""
+		mesh = widget.data
+		geometry_hash = hash_mesh_geometry(mesh)
+		shared_mesh = self.get_mesh(geometry_hash)
+		if not shared_mesh:
+			mesh[HASH_PROP] = geometry_hash
+			self.meshes[geometry_hash] = mesh.name
+			return mesh
+
+		if shared_mesh != mesh:
+			widget.data = shared_mesh
+			if mesh.users == 0:
+				bpy.data.meshes.remove(mesh)
+		return shared_mesh
+
+	def unshare_meshes(self, objects):
+		"""Give each widget object its own copy of its mesh, before the widgets get
+		re-loaded in-place, which would otherwise affect every widget sharing the mesh.
+		share_mesh() shares them again afterwards."""
+		for ob in objects:
+			if ob.type == 'MESH' and ob.data.users > 1 and HASH_PROP in ob.data:
+				ob.data = ob.data.copy()
+
+# Only one library is needed per Blender session.
+widget_library = WidgetLibrary()
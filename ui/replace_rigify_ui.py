@@ -57,9 +57,12 @@ def draw_cloudrig_rigify_generate(self, context):
 		return
 
 	text = "Generate CloudRig"
+	row = layout.row(align=True)
 	if metarig.data.rigify_target_rig:
 		text = "Re-Generate CloudRig"
-	layout.operator("pose.cloudrig_generate", text=text)
+	row.operator("pose.cloudrig_generate", text=text)
+	if metarig.data.rigify_target_rig:
+		row.operator("pose.cloudrig_generate", text="", icon='FILE_REFRESH').force = True
 	layout.separator()
 
 def draw_rigify_header(self, context):
@@ -144,6 +147,13 @@ def extend_rigify_advanced_panel(self, context):
 	if check_addon(context, 'bone_gizmos'):
 		layout.prop(cloudrig, 'auto_setup_gizmos')
 
+	layout.prop(cloudrig, 'full_refresh')
+	layout.prop(cloudrig, 'profile_generation')
+
+	target_rig = metarig.data.rigify_target_rig
+	if target_rig and 'generation_metrics' in target_rig.data:
+		layout.operator('pose.cloudrig_export_generation_metrics', icon='EXPORT')
+
 @classmethod
 def rigify_bone_groups_poll(cls, context):
 	# If the current rig has only cloudrig elements, don't draw this panel.